@@ -1,13 +1,23 @@
 # Standard Python libraries
+import math
+import queue
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 # Third-party libraries
 import requests
 
+# Local libraries
+from so4t_metrics import metrics
+from so4t_transport import Transport
+
 
 class V2Client(object):
 
-    def __init__(self, args):
+    def __init__(self, args, transport=None):
 
         if not args.url: # check if URL is provided; if not, exit
             print("Missing required argument. Please provide a URL.")
@@ -38,6 +48,16 @@ class V2Client(object):
                 print("See --help for more information")
                 raise SystemExit
 
+        # Number of pages to request in parallel; 1 keeps the original sequential paging
+        self.workers = max(1, args.workers)
+
+        # Filters that have already been created, so they are only created once per site
+        self.filters = {}
+
+        # Pooled HTTP session with retries; can be shared with the V3 client
+        self.transport = transport or Transport(max(args.pool_size, self.workers), 
+                                                args.max_retries, args.timeout)
+
         # Test the API connection and set the SSL verification variable
         self.ssl_verify = self.test_connection()
 
@@ -56,10 +76,11 @@ class V2Client(object):
 
         print("Testing API 2.3 connection...")
         try:
-            response = requests.get(url, params=params, headers=headers)
+            response = self.transport.request('get', url, params=params, headers=headers)
         except requests.exceptions.SSLError:
             print("SSL error. Trying again without SSL verification...")
-            response = requests.get(url, params=params, headers=headers, verify=False)
+            response = self.transport.request('get', url, params=params, headers=headers, 
+                                              verify=False)
             ssl_verify = False
         
         if response.status_code == 200:
@@ -90,14 +111,40 @@ class V2Client(object):
             # This converts the list of attributes into a string
             params['include'] = ';'.join(filter_attributes)
 
+        filter_key = (base, params.get('include'))
+        if filter_key in self.filters:
+            return self.filters[filter_key]
+
         response = self.get_items(endpoint_url, params)
         filter_string = response[0]['filter']
+        self.filters[filter_key] = filter_string
         print(f"Filter created: {filter_string}")
 
         return filter_string
     
 
-    def get_all_questions(self, filter_string=''):
+    def get_all_questions(self, filter_string='', since=None, fromdate=None, todate=None, 
+                          tagged=None):
+
+        questions = []
+        for page in self.get_question_pages(filter_string, since, fromdate, todate, tagged):
+            questions += page
+
+        return questions
+
+
+    def get_question_pages(self, filter_string='', since=None, fromdate=None, todate=None, 
+                           tagged=None):
+
+        # Returns a generator that yields one page of questions at a time
+        endpoint_url, params = self.get_question_params(filter_string, since, fromdate, todate, 
+                                                        tagged)
+    
+        return self.get_pages(endpoint_url, params)
+
+
+    def get_question_params(self, filter_string='', since=None, fromdate=None, todate=None, 
+                            tagged=None):
 
         # API endpoint documentation: https://api.stackexchange.com/docs/questions
         endpoint = "/questions"
@@ -109,8 +156,160 @@ class V2Client(object):
         }
         if filter_string:
             params['filter'] = filter_string
-    
-        return self.get_items(endpoint_url, params)
+        if since: # only get questions with activity since this date (new comments don't count)
+            # When sorting by activity, 'min' applies to the last_activity_date (Unix epoch time)
+            params['sort'] = 'activity'
+            params['min'] = since
+        # Limit the questions to those created within a date range (Unix epoch time) and/or with 
+        # specific tags. The API requires a semi-colon separated string of tags.
+        if fromdate:
+            params['fromdate'] = fromdate
+        if todate:
+            params['todate'] = todate
+        if tagged:
+            params['tagged'] = ';'.join(tagged)
+
+        return endpoint_url, params
+
+
+    def get_question_pages_by_time_slice(self, filter_string='', slice_count=8, fromdate=None, 
+                                         todate=None, tagged=None):
+
+        # On large sites, pages get slower to retrieve as the page number grows. Instead of paging
+        # through all questions with a single cursor, split the creation date range into time 
+        # slices of a similar number of questions, and page through each slice separately (in 
+        # parallel, with --workers). Yields the questions from each slice, in order.
+        time_slices = self.get_time_slices(slice_count, fromdate, todate, tagged)
+
+        # Each slice is paged through by its own worker, which hands its pages over through a small 
+        # queue, so that at most `workers` slices, and about three pages per slice, are held in 
+        # memory at once (as with --stream, memory doesn't grow with the number of questions)
+        stop_event = threading.Event()
+
+        def get_slice_pages(time_slice, page_queue):
+            try:
+                endpoint_url, params = self.get_question_params(
+                    filter_string, fromdate=time_slice[0], todate=time_slice[1], tagged=tagged)
+                # Sorting by creation date keeps the pages stable while they are being retrieved
+                params['sort'] = 'creation'
+                for page in self.get_pages(endpoint_url, params, workers=1):
+                    if not put_until_stopped(page_queue, page, stop_event):
+                        return
+                put_until_stopped(page_queue, None, stop_event) # end of the slice
+            except BaseException as error: # e.g. SystemExit from get_page; raised by the reader
+                put_until_stopped(page_queue, error, stop_event)
+
+        # Slices don't overlap, but a question can still be seen twice if it moves between pages 
+        # while a slice is being retrieved
+        question_ids = set()
+        time_slices = iter(time_slices)
+        page_queues = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                for time_slice in islice(time_slices, self.workers):
+                    page_queues.append(queue.Queue(maxsize=2))
+                    executor.submit(get_slice_pages, time_slice, page_queues[-1])
+                while page_queues:
+                    page_queue = page_queues.popleft()
+                    for time_slice in islice(time_slices, 1):
+                        page_queues.append(queue.Queue(maxsize=2))
+                        executor.submit(get_slice_pages, time_slice, page_queues[-1])
+                    while True:
+                        questions = page_queue.get()
+                        if questions is None:
+                            break
+                        if isinstance(questions, BaseException):
+                            raise questions
+                        questions = [question for question in questions 
+                                     if question['question_id'] not in question_ids]
+                        question_ids.update(question['question_id'] for question in questions)
+                        yield questions
+            finally: # also stop the workers if the pages are no longer wanted
+                stop_event.set()
+
+
+    def get_time_slices(self, slice_count, fromdate=None, todate=None, tagged=None):
+
+        # Without --until, the slices end at the newest question rather than the current time. 
+        # The boundaries then only depend on API responses, so they are the same when a run is 
+        # resumed (--resume) or replayed (--replay), and the last slice is left open-ended so 
+        # questions created since are still included.
+        open_ended = not todate
+        if not fromdate:
+            fromdate = self.get_oldest_question_date(tagged)
+        if not todate:
+            todate = self.get_newest_question_date(tagged)
+
+        def count_questions(time_slice):
+            endpoint_url, params = self.get_question_params(fromdate=time_slice[0], 
+                                                            todate=time_slice[1], tagged=tagged)
+            return self.get_item_count(endpoint_url, params)
+
+        def add_counts(time_slices):
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                counts = executor.map(count_questions, time_slices)
+                return [(start, end, count) for (start, end), count in zip(time_slices, counts)]
+
+        # Start with slices of equal length. fromdate and todate are both inclusive.
+        boundaries = [fromdate + (todate + 1 - fromdate) * i // slice_count 
+                      for i in range(slice_count + 1)]
+        time_slices = add_counts([(boundaries[i], boundaries[i + 1] - 1) 
+                                  for i in range(slice_count) if boundaries[i + 1] > boundaries[i]])
+        total = sum(count for start, end, count in time_slices)
+        target = max(1, math.ceil(total / slice_count))
+
+        # Busy periods get split in half until each slice is close to the target size (or is only
+        # an hour long), then quiet neighboring slices are merged
+        while True:
+            busy_slices = [(start, end) for start, end, count in time_slices 
+                           if count > target * 1.5 and end - start > 3600]
+            if not busy_slices:
+                break
+            halves = []
+            for start, end in busy_slices:
+                middle = (start + end) // 2
+                halves += [(start, middle), (middle + 1, end)]
+            halves = add_counts(halves)
+            time_slices = sorted(
+                [time_slice for time_slice in time_slices if time_slice[:2] not in busy_slices] 
+                + halves)
+
+        merged_slices = []
+        for start, end, count in time_slices:
+            if merged_slices and merged_slices[-1][2] + count <= target:
+                merged_slices[-1] = (merged_slices[-1][0], end, merged_slices[-1][2] + count)
+            else:
+                merged_slices.append((start, end, count))
+        merged_slices = [(start, end) for start, end, count in merged_slices if count]
+        if open_ended and merged_slices:
+            merged_slices[-1] = (merged_slices[-1][0], None)
+        print(f"Getting {total} questions in {len(merged_slices)} time slices")
+
+        return merged_slices
+
+
+    def get_oldest_question_date(self, tagged=None):
+
+        return self.get_question_creation_date(tagged, order='asc')
+
+
+    def get_newest_question_date(self, tagged=None):
+
+        return self.get_question_creation_date(tagged, order='desc')
+
+
+    def get_question_creation_date(self, tagged=None, order='asc'):
+
+        # Creation date of the oldest ('asc') or newest ('desc') question
+        endpoint_url, params = self.get_question_params(tagged=tagged)
+        params.update({'pagesize': 1, 'sort': 'creation', 'order': order})
+        if not self.soe:
+            params['team'] = self.team_slug
+        questions = self.get_page(endpoint_url, params).json().get('items')
+        if not questions:
+            return int(time.time())
+
+        return questions[0]['creation_date']
     
 
     def get_all_users(self, filter_string=''):
@@ -130,42 +329,118 @@ class V2Client(object):
 
 
     def get_items(self, endpoint_url, params):
+
+        items = []
+        for page in self.get_pages(endpoint_url, params):
+            items += page
+
+        return items
+
+
+    def get_pages(self, endpoint_url, params, workers=None):
         
+        # Generator that yields the items from each page, in page order, as they are received
         # SO Business and Basic require a team slug parameter
         if not self.soe:
             params['team'] = self.team_slug
 
-        items = []
+        workers = workers or self.workers
+        if workers > 1 and params.get('page'):
+            page_count = self.get_page_count(endpoint_url, params)
+            if page_count > 1:
+                yield from self.get_pages_concurrently(endpoint_url, params, page_count)
+                return
+
         while True: # Keep performing API calls until all items are received
             if params.get('page'):
                 print(f"Getting page {params['page']} from {endpoint_url}")
             else:
                 print(f"Getting data from {endpoint_url}")
-            response = requests.get(endpoint_url, headers=self.headers, params=params, 
-                                    verify=self.ssl_verify)
-            
-            if response.status_code != 200:
-                # Many API call failures result in an HTTP 400 status code (Bad Request)
-                # To understand the reason for the 400 error, specific API error codes can be 
-                # found here: https://api.stackoverflowteams.com/docs/error-handling
-                print(f"/{endpoint_url} API call failed with status code: {response.status_code}.")
-                print(response.text)
-                print(f"Failed request URL and params: {response.request.url}")
-                break
+            json_data = self.get_page(endpoint_url, params).json()
 
-            items += response.json().get('items')
-            if not response.json().get('has_more'):
+            yield json_data.get('items')
+            if not json_data.get('has_more'):
                 break
 
-            # If the endpoint gets overloaded, it will send a backoff request in the response
-            # Failure to backoff will result in a 502 error (throttle_violation)
-            # Rate limiting documentation: https://api.stackexchange.com/docs/throttle
-            if response.json().get('backoff'):
-                backoff_time = response.json().get('backoff') + 1
-                print(f"API backoff request received. Waiting {backoff_time} seconds...")
-                time.sleep(backoff_time)
-
             params['page'] += 1
 
-        return items
-  
\ No newline at end of file
+
+    def get_page_count(self, endpoint_url, params):
+
+        total = self.get_item_count(endpoint_url, params)
+        page_count = math.ceil(total / params.get('pagesize', 30))
+        print(f"{total} items across {page_count} pages found at {endpoint_url}")
+
+        return page_count
+
+
+    def get_item_count(self, endpoint_url, params):
+
+        # The built-in 'total' filter returns only the number of matching items
+        # Filter documentation: https://api.stackexchange.com/docs/filters
+        total_params = dict(params, filter='total')
+        total_params.pop('page', None)
+        if not self.soe:
+            total_params['team'] = self.team_slug
+        response = self.get_page(endpoint_url, total_params)
+
+        return response.json().get('total', 0)
+
+
+    def get_pages_concurrently(self, endpoint_url, params, page_count):
+
+        def get_page_items(page):
+            print(f"Getting page {page} from {endpoint_url}")
+            response = self.get_page(endpoint_url, dict(params, page=page))
+            return response.json().get('items')
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            yield from map_in_order(executor, get_page_items, range(1, page_count + 1), 
+                                    self.workers * 2)
+
+
+    def get_page(self, endpoint_url, params):
+
+        # Backoff requests, throttle violations and temporary failures are retried by the transport
+        response = self.transport.request('get', endpoint_url, headers=self.headers, 
+                                          params=params, verify=self.ssl_verify)
+        
+        if response.status_code != 200:
+            # Many API call failures result in an HTTP 400 status code (Bad Request)
+            # To understand the reason for the 400 error, specific API error codes can be 
+            # found here: https://api.stackoverflowteams.com/docs/error-handling
+            # Stop here rather than carrying on with partial data
+            print(f"/{endpoint_url} API call failed with status code: {response.status_code}.")
+            print(response.text)
+            print(f"Failed request URL and params: {response.request.url}")
+            raise SystemExit
+
+        metrics.increment('v2_pages')
+        return response
+
+
+def put_until_stopped(item_queue, item, stop_event):
+
+    # Like item_queue.put, but gives up (returning False) once `stop_event` is set, so a worker 
+    # doesn't wait forever for a reader that has stopped
+    while not stop_event.is_set():
+        try:
+            item_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def map_in_order(executor, function, items, lookahead):
+
+    # Like executor.map, but only `lookahead` items are submitted ahead of the result being 
+    # yielded, so results don't pile up in memory when they are produced faster than they are used
+    items = iter(items)
+    pending = deque(executor.submit(function, item) for item in islice(items, lookahead))
+    while pending:
+        result = pending.popleft().result()
+        for item in islice(items, 1):
+            pending.append(executor.submit(function, item))
+        yield result
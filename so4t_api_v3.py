@@ -1,13 +1,19 @@
 # Standard Python libraries
+import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 # Third-party libraries
 import requests
 
+# Local libraries
+from so4t_metrics import metrics
+from so4t_transport import Transport
+
 
 class V3Client(object):
 
-    def __init__(self, args):
+    def __init__(self, args, transport=None):
 
         if not args.url: # check if URL is provided; if not, exit
             print("Missing required argument. Please provide a URL.")
@@ -28,6 +34,16 @@ class V3Client(object):
         else: # Stack Overflow Enterprise
             self.api_url = args.url + "/api/v3"
 
+        # Number of pages to request in parallel; 1 keeps the original sequential paging
+        self.workers = max(1, args.workers)
+
+        # Maximum number of independent API calls (e.g. SMEs for each tag) in flight at once
+        self.concurrency = max(args.pool_size, self.workers)
+
+        # Pooled HTTP session with retries; can be shared with the V2 client
+        self.transport = transport or Transport(max(args.pool_size, self.workers), 
+                                                args.max_retries, args.timeout)
+
         self.ssl_verify = self.test_connection() # test the API connection
 
     
@@ -39,10 +55,11 @@ class V3Client(object):
 
         print("Testing API v3 connection...")
         try:
-            response = requests.get(endpoint_url, headers=self.headers)
+            response = self.transport.request('get', endpoint_url, headers=self.headers)
         except requests.exceptions.SSLError:
             print("SSL error. Trying again without SSL verification...")
-            response = requests.get(endpoint_url, headers=self.headers, verify=False)
+            response = self.transport.request('get', endpoint_url, headers=self.headers, 
+                                              verify=False)
             ssl_verify = False
         
         if response.status_code == 200:
@@ -67,6 +84,41 @@ class V3Client(object):
             return users
 
 
+    def get_user_count(self):
+
+        # With one user per page, the number of pages is the number of users
+        endpoint_url = self.api_url + "/users"
+        response = self.send_request('get', endpoint_url, {'page': 1, 'pagesize': 1})
+
+        return response.json()['totalPages']
+
+
+    def get_users_by_id(self, user_ids):
+
+        # Requests specific users (in parallel), rather than the whole user list
+        # Returns a dict of user ID -> user, where deleted users are None
+        # API v2 can request up to 100 users per call, but its users don't have a department
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            users = executor.map(self.get_user, user_ids)
+            return dict(zip(user_ids, users))
+
+
+    def get_user(self, user_id):
+
+        endpoint_url = f"{self.api_url}/users/{user_id}"
+        response = self.transport.request('get', endpoint_url, headers=self.headers, 
+                                          verify=self.ssl_verify)
+        if response.status_code == 404: # the user has been deleted
+            return None
+        if response.status_code != 200:
+            print(f"API call to {endpoint_url} failed with status code {response.status_code}")
+            print(response.text)
+            raise SystemExit
+
+        metrics.increment('v3_pages')
+        return response.json()
+
+
     def get_all_tags(self):
 
         method = "get"
@@ -89,24 +141,47 @@ class V3Client(object):
         return smes
 
 
+    def get_users_and_tag_smes(self, include_users=True):
+
+        # Returns all users (or None, if `include_users` is False), along with the user IDs of the 
+        # SMEs for each tag name
+        return asyncio.run(self.gather_users_and_tag_smes(include_users))
+
+
+    async def gather_users_and_tag_smes(self, include_users=True):
+
+        # Users and tags are requested at the same time, followed by the SMEs for every tag, so the 
+        # total time is close to that of the slowest calls rather than the sum of all of them.
+        # The requests themselves are made with the (blocking) transport in a thread pool; the 
+        # semaphore limits how many are waiting in the pool at once.
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency + 1) as executor:
+            async def call(function, *args):
+                async with semaphore:
+                    return await loop.run_in_executor(executor, function, *args)
+
+            # The users have their own paging (see --workers), so they don't take up the semaphore
+            if include_users:
+                users_future = loop.run_in_executor(executor, self.get_all_users)
+            tags = await call(self.get_all_tags)
+            tag_smes = await asyncio.gather(*(call(self.get_tag_smes, tag['id']) for tag in tags))
+            users = await users_future if include_users else None
+
+        tag_smes = {tag['name']: get_sme_user_ids(smes) for tag, smes in zip(tags, tag_smes)}
+        print(f"Received SMEs for {len(tag_smes)} tags")
+
+        return users, tag_smes
+
+
     def send_api_call(self, method, endpoint, params={}):
 
-        get_response = getattr(requests, method, None) # get the method from the requests library
         endpoint_url = self.api_url + endpoint
 
         data = []
         while True:
-            if method == 'get':
-                response = get_response(endpoint_url, headers=self.headers, params=params, 
-                                        verify=self.ssl_verify)
-            else:
-                response = get_response(endpoint_url, headers=self.headers, json=params, 
-                                        verify=self.ssl_verify)
-
-            if response.status_code not in [200, 201, 204]:
-                print(f"API call to {endpoint_url} failed with status code {response.status_code}")
-                print(response.text)
-                raise SystemExit
+            response = self.send_request(method, endpoint_url, params)
                         
             try:
                 json_data = response.json()
@@ -119,6 +194,10 @@ class V3Client(object):
                 data += json_data['items']
                 if params['page'] == json_data['totalPages']:
                     break
+                if self.workers > 1: # the first page reveals how many pages remain
+                    data += self.get_remaining_pages(
+                        method, endpoint_url, params, json_data['totalPages'])
+                    break
                 params['page'] += 1
             else:
                 print(f"API request successfully sent to {endpoint_url}")
@@ -126,3 +205,49 @@ class V3Client(object):
                 break
 
         return data
+
+
+    def get_remaining_pages(self, method, endpoint_url, params, total_pages):
+
+        def get_page_items(page):
+            response = self.send_request(method, endpoint_url, dict(params, page=page))
+            print(f"Received page {page} from {endpoint_url}")
+            return response.json()['items']
+
+        # executor.map returns results in the order submitted, which keeps the items in page order
+        items = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for page_items in executor.map(get_page_items, range(params['page'] + 1, 
+                                                                   total_pages + 1)):
+                items += page_items
+
+        return items
+
+
+    def send_request(self, method, endpoint_url, params):
+
+        # Rate limiting (HTTP 429) and temporary failures are retried by the transport
+        if method == 'get':
+            response = self.transport.request(method, endpoint_url, headers=self.headers, 
+                                              params=params, verify=self.ssl_verify)
+        else:
+            response = self.transport.request(method, endpoint_url, headers=self.headers, 
+                                              json_data=params, verify=self.ssl_verify)
+
+        if response.status_code not in [200, 201, 204]:
+            print(f"API call to {endpoint_url} failed with status code {response.status_code}")
+            print(response.text)
+            raise SystemExit
+
+        metrics.increment('v3_pages')
+        return response
+
+
+def get_sme_user_ids(smes):
+
+    # SMEs can be assigned to a tag individually or as members of a user group
+    user_ids = [user['id'] for user in smes.get('users', [])]
+    for user_group in smes.get('userGroups', []):
+        user_ids += [user['id'] for user in user_group.get('users', [])]
+
+    return list(dict.fromkeys(user_ids)) # remove duplicates, keeping the order
@@ -0,0 +1,246 @@
+'''
+This Python script is offered with no formal support.
+If you run into difficulties, reach out to the person who provided you with this script.
+
+Runs so4t_interactions.py for several sites at once, from a JSON file of sites and arguments.
+Each site gets its own output directory, and a summary of all of the sites is written to
+batch_summary.csv.
+'''
+
+# Standard library imports
+import argparse
+import csv
+import json
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+from urllib.parse import urlparse
+
+# Local libraries
+from so4t_interactions import get_args as get_site_args
+from so4t_interactions import run
+from so4t_metrics import metrics
+
+
+# Arguments that are file or directory paths. These are relative to the directory the batch is
+# run from, rather than to each site's output directory.
+PATH_ARGUMENTS = ['team_rename', 'cache_dir', 'checkpoint', 'record', 'replay']
+
+# Arguments that take several values, rather than a comma-separated list
+MULTI_VALUE_ARGUMENTS = ['timeout']
+
+SUMMARY_FIELDS = ['site', 'url', 'status', 'seconds', 'users', 'questions', 'interactions',
+                  'teams', 'team_interactions', 'api_requests', 'api_retries', 'error']
+
+
+def main():
+
+    args = get_args()
+    defaults, sites = load_config(args.config)
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Import the processing libraries once, before the worker processes are started, so the
+    # workers don't each spend seconds importing them (where processes are forked, e.g. Linux)
+    preload_libraries(defaults, sites)
+
+    # Sites on the same API host share its rate limits (e.g. every Business and Basic site uses 
+    # api.stackoverflowteams.com), and each site's process only knows about its own backoff and
+    # throttling requests. So the sites on each host are run one after another, and only sites
+    # on different hosts are run at the same time.
+    site_groups = group_sites_by_host(sites, defaults)
+    parallel_sites = min(args.parallel_sites or len(site_groups), len(site_groups))
+    print(f"Running {len(sites)} sites on {len(site_groups)} API hosts, {parallel_sites} at a "
+          f"time...")
+    start_time = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=parallel_sites) as executor:
+        futures = [executor.submit(run_site_group, site_group, defaults, output_dir) 
+                   for site_group in site_groups]
+        for future in as_completed(futures):
+            for result in future.result():
+                results[result['site']] = result
+                print(f"{result['site']}: {result['status']} in {result['seconds']} seconds "
+                      f"{result['error']}".rstrip())
+
+    # Sites are listed in the same order as in the config file
+    summary_file = os.path.join(output_dir, 'batch_summary.csv')
+    with open(summary_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for site in sites:
+            writer.writerow(results[site['name']])
+
+    print(f"All sites completed in {time.perf_counter() - start_time:.1f} seconds")
+    print(f"'{summary_file}' has been created.")
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        prog='so4t_batch.py',
+        description='Run so4t_interactions.py for several Stack Overflow for Teams sites at once')
+    parser.add_argument('--config',
+                        type=str,
+                        required=True,
+                        help='JSON file listing the sites and their arguments. See '
+                        'Templates/batch_sites.json')
+    parser.add_argument('--output-dir',
+                        type=str,
+                        default='batch',
+                        help='Directory for the results. Each site gets a subdirectory with the '
+                        'site name. Default: batch')
+    parser.add_argument('--parallel-sites',
+                        type=int,
+                        default=0,
+                        help='Number of sites to run at the same time. Sites on the same API host '
+                        '(e.g. all Business and Basic sites) are always run one after another. '
+                        'Default: all of them')
+
+    return parser.parse_args()
+
+
+def load_config(file_name):
+
+    with open(file_name, 'r') as f:
+        config = json.load(f)
+
+    defaults = config.get('defaults', {})
+    sites = config.get('sites', [])
+    if not sites:
+        print(f"No sites found in '{file_name}'.")
+        raise SystemExit
+
+    # Site names are used as directory names, so they must be unique and safe to use as such
+    site_names = set()
+    for site in sites:
+        name = site.get('name', '')
+        if not re.fullmatch(r'[\w.-]+', name) or name in site_names:
+            print(f"Each site needs a unique name, made of letters, numbers, '.', '-' or '_'. "
+                  f"Invalid name: '{name}'")
+            raise SystemExit
+        site_names.add(name)
+
+    # Make relative paths absolute now, since each site runs in its own output directory
+    config_dir = os.getcwd()
+    for options in [defaults] + sites:
+        for argument in PATH_ARGUMENTS:
+            if options.get(argument):
+                options[argument] = os.path.join(config_dir, options[argument])
+
+    return defaults, sites
+
+
+def preload_libraries(defaults, sites):
+
+    import numpy
+    import pandas
+
+    site_options = [dict(defaults, **site) for site in sites]
+    if any(options.get('renderer', 'd3blocks') == 'd3blocks' and not options.get('fetch_only')
+           for options in site_options):
+        import d3blocks
+
+
+def group_sites_by_host(sites, defaults):
+
+    # Groups the sites by API host, keeping the order of the config file
+    site_groups = {}
+    for site in sites:
+        url = dict(defaults, **site).get('url') or ''
+        site_groups.setdefault(get_api_host(url), []).append(site)
+
+    return list(site_groups.values())
+
+
+def get_api_host(url):
+
+    # Stack Overflow Business and Basic sites use a shared API host (see V2Client and V3Client);
+    # Enterprise sites are served from their own URL
+    if 'stackoverflowteams.com' in url:
+        return 'api.stackoverflowteams.com'
+
+    return urlparse(url).netloc.lower()
+
+
+def run_site_group(site_group, defaults, output_dir):
+
+    # Runs in a worker process; the sites share an API host, so they are run one at a time
+    return [run_site(site, defaults, output_dir) for site in site_group]
+
+
+def run_site(site, defaults, output_dir):
+
+    # Runs in a worker process. The output files are written to the current directory, so each
+    # site changes to its own directory, and the log for the site is written to log.txt there.
+    site_dir = os.path.join(output_dir, site['name'])
+    os.makedirs(site_dir, exist_ok=True)
+    os.chdir(site_dir)
+    metrics.reset()
+
+    options = dict(defaults, **site)
+    result = {'site': site['name'], 'url': options.get('url', ''), 'status': 'ok', 'error': ''}
+    pair_counts = None
+    start_time = time.perf_counter()
+    with open('log.txt', 'w') as log, redirect_stdout(log), redirect_stderr(log):
+        try:
+            pair_counts = run(get_site_args(get_site_argv(options)))
+        except SystemExit: # the reason has already been printed to the log
+            result['status'] = 'error'
+            result['error'] = f"see {os.path.join(site_dir, 'log.txt')}"
+        except Exception as error:
+            traceback.print_exc()
+            result['status'] = 'error'
+            result['error'] = f"{error.__class__.__name__}: {error}"
+    result['seconds'] = round(time.perf_counter() - start_time, 1)
+
+    stages = metrics.stages
+    result['users'] = stages.get('get_user_data', {}).get('items')
+    result['questions'] = (stages.get('get_question_data', {}).get('items')
+                           or metrics.counters['questions'])
+    result['interactions'] = (stages.get('create_interaction_data', {}).get('items')
+                              or metrics.counters['interactions'])
+    if pair_counts is not None:
+        result['teams'] = len({team for pair in pair_counts for team in pair})
+        result['team_interactions'] = sum(pair_counts.values())
+    result['api_requests'] = metrics.counters['api_requests']
+    result['api_retries'] = metrics.counters['api_retries']
+
+    return result
+
+
+def get_site_argv(options):
+
+    # Turns the options for a site into so4t_interactions.py command line arguments
+    # Examples: {"workers": 4} -> --workers 4, {"stream": true} -> --stream,
+    # {"tags": ["python", "java"]} -> --tags python,java,
+    # {"team_regex": [["^Eng.*", "Engineering"]]} -> --team-regex "^Eng.*" "Engineering",
+    # {"timeout": [10, 300]} -> --timeout 10 300
+    # String values can refer to environment variables (e.g. "$SO_TOKEN"), to keep tokens out of
+    # the config file
+    argv = []
+    for name, value in options.items():
+        if name == 'name' or value is None or value is False:
+            continue
+        flag = '--' + name.replace('_', '-')
+        if value is True:
+            argv.append(flag)
+        elif isinstance(value, list) and all(isinstance(item, list) for item in value):
+            for item in value:
+                argv += [flag] + [str(part) for part in item]
+        elif isinstance(value, list) and name in MULTI_VALUE_ARGUMENTS:
+            argv += [flag] + [str(item) for item in value]
+        elif isinstance(value, list):
+            argv += [flag, ','.join(str(item) for item in value)]
+        else:
+            argv += [flag, os.path.expandvars(str(value))]
+
+    return argv
+
+
+if __name__ == '__main__':
+
+    main()
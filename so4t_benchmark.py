@@ -0,0 +1,354 @@
+'''
+This Python script is offered with no formal support.
+If you run into difficulties, reach out to the person who provided you with this script.
+
+Benchmarks the data processing in so4t_interactions.py against synthetic data, so no
+Stack Overflow for Teams instance (or API access) is required.
+'''
+
+# Standard library imports
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+
+# Local libraries
+from so4t_interactions import (LookupIndex, build_interaction_matrix, count_team_pairs,
+                               create_chord_diagram, create_interaction_data,
+                               create_interaction_data_in_parallel, get_user_data)
+
+
+def main():
+
+    args = get_args()
+
+    # The stages write their output files to the current directory, so use a temporary one
+    report_file = os.path.abspath(args.report)
+    os.chdir(tempfile.mkdtemp(prefix='so4t_benchmark_'))
+
+    results = []
+    for post_count in args.scales:
+        random.seed(args.seed)
+        users = generate_users(args.users, args.teams)
+        questions = generate_questions(post_count, users)
+        print(f"\nBenchmarking {post_count} posts ({len(questions)} questions) "
+              f"and {len(users)} users...")
+        results.append({
+            'posts': post_count,
+            'questions': len(questions),
+            'users': len(users),
+            'stages': benchmark_stages(users, questions, args.memory)
+        })
+
+        if args.lookups:
+            benchmark_lookups(users, questions, args.lookups)
+        if args.processes > 1:
+            benchmark_extraction(users, questions, args.processes)
+        if args.columnar:
+            benchmark_columnar(users, questions)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'teams': args.teams,
+        'results': results
+    }
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\n'{report_file}' has been created.")
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        prog='so4t_benchmark.py',
+        description='Benchmark so4t_interactions.py against synthetic data')
+    parser.add_argument('--scales',
+                        type=lambda value: [int(scale) for scale in value.split(',')],
+                        default=[1000, 10000, 100000],
+                        help='Comma-separated numbers of posts (questions, answers, and comments) '
+                        'to benchmark. Example: 1000,10000,100000,1000000. '
+                        'Default: 1000,10000,100000')
+    parser.add_argument('--users',
+                        type=int,
+                        default=40000,
+                        help='Number of synthetic users to generate. Default: 40000')
+    parser.add_argument('--teams',
+                        type=int,
+                        default=200,
+                        help='Number of synthetic teams (departments). Default: 200')
+    parser.add_argument('--no-memory',
+                        dest='memory',
+                        action='store_false',
+                        help='Skip measuring peak memory use, which runs each stage a second time '
+                        'with memory tracing enabled')
+    parser.add_argument('--report',
+                        type=str,
+                        default='benchmark_report.json',
+                        help='File to write the benchmark results to. '
+                        'Default: benchmark_report.json')
+    parser.add_argument('--lookups',
+                        type=int,
+                        default=0,
+                        help='If set, also compare this many user and question lookups against a '
+                        'linear scan of the users and questions')
+    parser.add_argument('--processes',
+                        type=int,
+                        default=1,
+                        help='If more than 1, also time interaction extraction with this many '
+                        'processes and check that the results match the serial extraction')
+    parser.add_argument('--columnar',
+                        action='store_true',
+                        help='Also time the columnar engine (--engine columnar) and check that its '
+                        'team pair counts match the serial extraction')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed for the synthetic data. Default: 0')
+
+    return parser.parse_args()
+
+
+class SyntheticV3Client(object):
+
+    # Stands in for V3Client in get_user_data, returning synthetic users instead of calling the API
+    def __init__(self, users):
+
+        self.users = users
+        self.api_url = 'https://synthetic.stackenterprise.co/api/v3'
+
+
+    def get_all_users(self):
+
+        # get_user_data changes team names in place, so return a fresh copy each time
+        return [dict(user) for user in self.users]
+
+
+def generate_users(user_count, team_count):
+
+    # Mimics the user data from API v3, which uses an 'id' key
+    # IDs start at 2 because get_user_data excludes the Community user and user groups
+    users = []
+    for user_id in range(2, user_count + 2):
+        users.append({
+            'id': user_id,
+            'department': get_team_name(random.randrange(team_count))
+        })
+
+    return users
+
+
+def get_team_name(team_number):
+
+    # Team names are made of letters (Team A, Team B, ... Team AA), since get_user_data can remove
+    # numbers from the end of team names
+    letters = ''
+    while True:
+        team_number, remainder = divmod(team_number, 26)
+        letters = string.ascii_uppercase[remainder] + letters
+        if not team_number:
+            break
+        team_number -= 1
+
+    return f"Team {letters}"
+
+
+def generate_questions(post_count, users):
+
+    # Mimics the question data from API v2 (see get_question_data), which uses 'question_id' and
+    # 'user_id' keys. Questions have up to 3 answers, and questions and answers have up to 3
+    # comments. Questions are generated until there are `post_count` posts in total.
+    questions = []
+    answer_id = post_count
+    posts = 0
+    while posts < post_count:
+        question_id = len(questions) + 1
+        question = {
+            'question_id': question_id,
+            'owner': generate_owner(users),
+            'tags': [f"tag-{random.randrange(100)}"],
+            'answers': [],
+            'comments': generate_comments(users, question_id)
+        }
+        for _ in range(random.randrange(4)):
+            answer_id += 1
+            question['answers'].append({
+                'answer_id': answer_id,
+                'question_id': question_id,
+                'owner': generate_owner(users),
+                'comments': generate_comments(users, answer_id)
+            })
+        posts += 1 + len(question['comments']) + sum(
+            1 + len(answer['comments']) for answer in question['answers'])
+        questions.append(question)
+
+    return questions
+
+
+def generate_comments(users, post_id):
+
+    return [{'post_id': post_id, 'owner': generate_owner(users)}
+            for _ in range(random.randrange(4))]
+
+
+def generate_owner(users):
+
+    # About 1 in 50 posts is from a deleted user, which has no user_id
+    if random.random() < 0.02:
+        return {'user_type': 'does_not_exist'}
+
+    return {'user_id': random.choice(users)['id']}
+
+
+def benchmark_stages(users, questions, measure_memory=True):
+
+    # Each stage takes the output of the previous one, as in so4t_interactions.py
+    client = SyntheticV3Client(users)
+    stages = [
+        ('get_user_data',
+         lambda data: get_user_data(client)),
+        ('create_interaction_data',
+         lambda data: create_interaction_data(questions, LookupIndex(data))[0]),
+        ('create_interaction_matrix',
+         lambda data: create_interaction_matrix(data)),
+        ('create_chord_diagram',
+         lambda data: create_chord_diagram(data)),
+    ]
+
+    results = {}
+    data = None
+    for stage_name, stage in stages:
+        result = {}
+        try:
+            start_time = time.perf_counter()
+            output = stage(data)
+            result['seconds'] = round(time.perf_counter() - start_time, 4)
+
+            if measure_memory: # tracing slows things down, so it gets a separate run
+                tracemalloc.start()
+                stage(data)
+                result['peak_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+                tracemalloc.stop()
+        except Exception as error: # record the failure and carry on with the next scale
+            tracemalloc.stop()
+            result['error'] = f"{error.__class__.__name__}: {error}"
+            print(f"{stage_name} failed: {result['error']}")
+            results[stage_name] = result
+            break
+
+        if output is not None and hasattr(output, '__len__'):
+            result['items'] = len(output)
+            if result['seconds']:
+                result['items_per_second'] = round(len(output) / result['seconds'])
+        print(f"{stage_name}: {result}")
+        results[stage_name] = result
+        data = output
+
+    return results
+
+
+def create_interaction_matrix(interaction_data):
+
+    # Returns the team pair counts, which the chord diagram is created from
+    pair_counts = count_team_pairs(interaction_data)
+    build_interaction_matrix(pair_counts)
+
+    return pair_counts
+
+
+def benchmark_lookups(users, questions, lookup_count):
+
+    user_ids = [random.choice(users)['id'] for _ in range(lookup_count)]
+    question_ids = [random.choice(questions)['question_id'] for _ in range(lookup_count)]
+
+    # Baseline: a linear scan over the full lists for every lookup
+    start_time = time.perf_counter()
+    for user_id in user_ids:
+        next((item for item in users if int(item['id']) == user_id), None)
+    for question_id in question_ids:
+        next((item for item in questions if int(item['question_id']) == question_id), None)
+    scan_time = time.perf_counter() - start_time
+
+    # Indexed: build the lookups once, then resolve each ID with a dictionary lookup
+    # (the script itself no longer looks up questions, since answers are handed their question)
+    start_time = time.perf_counter()
+    index = LookupIndex(users)
+    question_index = {int(question['question_id']): question for question in questions}
+    build_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    for user_id in user_ids:
+        index.find_user_team(user_id)
+    for question_id in question_ids:
+        question_index.get(int(question_id))
+    index_time = time.perf_counter() - start_time
+
+    print(f"Users: {len(users)}, questions: {len(questions)}, lookups: {lookup_count * 2}")
+    print(f"Linear scan: {scan_time:.3f} seconds")
+    print(f"Lookup index: {index_time:.3f} seconds (plus {build_time:.3f} seconds to build)")
+    print(f"Speedup: {scan_time / (index_time + build_time):.0f}x")
+
+
+def benchmark_extraction(users, questions, processes):
+
+    start_time = time.perf_counter()
+    index = LookupIndex(users)
+    interaction_data, untracked_interactions = create_interaction_data(questions, index)
+    pair_counts = count_team_pairs(interaction_data)
+    serial_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    parallel_results = create_interaction_data_in_parallel(questions, users, processes)
+    parallel_time = time.perf_counter() - start_time
+
+    print(f"Serial extraction: {serial_time:.3f} seconds")
+    print(f"Extraction with {processes} processes: {parallel_time:.3f} seconds")
+    if parallel_results != (len(interaction_data), untracked_interactions, pair_counts):
+        print("Results from the parallel extraction do not match the serial extraction")
+        raise SystemExit(1)
+    print("Results from the parallel extraction match the serial extraction")
+
+    # A speedup can only be expected when each process has a CPU of its own
+    if (os.cpu_count() or 1) < processes:
+        print(f"Only {os.cpu_count()} CPUs are available, so the speedup from {processes} "
+              f"processes can't be measured")
+    elif parallel_time >= serial_time:
+        print(f"Extraction with {processes} processes is not faster than the serial extraction")
+        raise SystemExit(1)
+    else:
+        print(f"Extraction with {processes} processes is {serial_time / parallel_time:.1f}x "
+              f"faster than the serial extraction")
+
+
+def benchmark_columnar(users, questions):
+
+    from so4t_columnar import count_team_pairs_columnar
+
+    start_time = time.perf_counter()
+    index = LookupIndex(users)
+    interaction_data, untracked_interactions = create_interaction_data(questions, index)
+    pair_counts = count_team_pairs(interaction_data)
+    serial_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    columnar_results = count_team_pairs_columnar(questions, LookupIndex(users).user_teams)
+    columnar_time = time.perf_counter() - start_time
+
+    print(f"Serial extraction: {serial_time:.3f} seconds")
+    print(f"Columnar engine: {columnar_time:.3f} seconds")
+    if columnar_results != (pair_counts, untracked_interactions):
+        print("Results from the columnar engine do not match the serial extraction")
+        raise SystemExit(1)
+    print("Results from the columnar engine match the serial extraction")
+
+
+if __name__ == '__main__':
+
+    main()
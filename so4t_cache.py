@@ -0,0 +1,227 @@
+# Standard Python libraries
+import json
+import os
+import random
+import re
+import sqlite3
+import time
+
+
+class DataCache(object):
+
+    def __init__(self, cache_dir, site_url):
+
+        # Each site gets its own database file, named after the site URL
+        # Example: https://SUBDOMAIN.stackenterprise.co -> SUBDOMAIN_stackenterprise_co.sqlite3
+        os.makedirs(cache_dir, exist_ok=True)
+        site_name = re.sub(r'\W+', '_', site_url.split('://')[-1]).strip('_')
+        self.db_path = os.path.join(cache_dir, f"{site_name}.sqlite3")
+
+        self.connection = sqlite3.connect(self.db_path)
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS questions (
+                question_id INTEGER PRIMARY KEY,
+                last_activity_date INTEGER,
+                data TEXT NOT NULL)''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at INTEGER,
+                last_used INTEGER)''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL)''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS filters (
+                name TEXT PRIMARY KEY,
+                filter TEXT NOT NULL)''')
+
+            # Caches created by earlier versions don't have the user timestamps
+            user_columns = [row[1] for row in self.connection.execute('PRAGMA table_info(users)')]
+            for column in ['fetched_at', 'last_used']:
+                if column not in user_columns:
+                    self.connection.execute(f'ALTER TABLE users ADD COLUMN {column} INTEGER')
+
+
+    def get_last_sync(self, name):
+
+        row = self.connection.execute(
+            'SELECT value FROM sync_state WHERE name = ?', (name,)).fetchone()
+
+        return row[0] if row else None
+
+
+    def set_last_sync(self, name, timestamp):
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)', (name, timestamp))
+
+
+    def get_filter(self, name):
+
+        row = self.connection.execute(
+            'SELECT filter FROM filters WHERE name = ?', (name,)).fetchone()
+
+        return row[0] if row else None
+
+
+    def save_filter(self, name, filter_string):
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO filters (name, filter) VALUES (?, ?)', (name, filter_string))
+
+
+    def save_questions(self, questions):
+
+        # Questions that were already cached are replaced by the newer version
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO questions (question_id, last_activity_date, data) '
+                'VALUES (?, ?, ?)',
+                ((question['question_id'], question.get('last_activity_date'), json.dumps(question))
+                 for question in questions))
+
+
+    def load_questions(self, fromdate=None, todate=None, tagged=None):
+
+        questions = []
+        for page in self.get_question_pages(fromdate=fromdate, todate=todate, tagged=tagged):
+            questions += page
+
+        return questions
+
+
+    def get_question_pages(self, page_size=100, fromdate=None, todate=None, tagged=None):
+
+        # Generator that yields the cached questions a page at a time, so they don't all need to 
+        # be held in memory. Most recently active first, matching the /questions endpoint.
+        # The cache can hold questions from runs with other limits (--since, --until, --tags), so
+        # only the questions within the given limits are returned, as the API would
+        cursor = self.connection.execute(
+            'SELECT data FROM questions ORDER BY last_activity_date DESC, question_id DESC')
+        while True:
+            rows = cursor.fetchmany(page_size)
+            if not rows:
+                break
+            questions = [json.loads(row[0]) for row in rows]
+            if fromdate or todate or tagged:
+                questions = [question for question in questions 
+                             if question_in_scope(question, fromdate, todate, tagged)]
+            if questions:
+                yield questions
+
+
+    def remove_other_questions(self, question_ids, fromdate=None, todate=None, tagged=None):
+
+        # After all of the questions within the limits have been requested, any other cached 
+        # question within the limits has been deleted from the site, so remove it as well
+        question_ids = set(question_ids)
+        cursor = self.connection.execute('SELECT question_id, data FROM questions')
+        removed_ids = []
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for question_id, data in rows:
+                if question_id in question_ids:
+                    continue
+                if fromdate or todate or tagged:
+                    if not question_in_scope(json.loads(data), fromdate, todate, tagged):
+                        continue
+                removed_ids.append(question_id)
+
+        with self.connection:
+            self.connection.executemany('DELETE FROM questions WHERE question_id = ?',
+                                        ((question_id,) for question_id in removed_ids))
+
+        return len(removed_ids)
+
+
+    def save_users(self, users):
+
+        # The full user list is fetched on every run, so it replaces the cached list
+        now = int(time.time())
+        with self.connection:
+            self.connection.execute('DELETE FROM users')
+            self.connection.executemany(
+                'INSERT INTO users (id, data, fetched_at, last_used) VALUES (?, ?, ?, ?)',
+                ((user['id'], json.dumps(user), now, now) for user in users))
+
+
+    def get_users(self, user_ids, max_age):
+
+        # Returns the cached users that were fetched within the last `max_age` seconds, and the 
+        # IDs of the users that are missing or older than that (and need to be requested again)
+        now = int(time.time())
+        user_ids = list(user_ids)
+        users = []
+        fresh_ids = set()
+        for i in range(0, len(user_ids), 500): # SQLite limits the number of query parameters
+            chunk = user_ids[i:i + 500]
+            rows = self.connection.execute(
+                f"SELECT id, data FROM users WHERE fetched_at >= ? "
+                f"AND id IN ({','.join('?' * len(chunk))})", [now - max_age] + chunk).fetchall()
+            for user_id, data in rows:
+                fresh_ids.add(user_id)
+                user = json.loads(data)
+                if user: # not a deleted user
+                    users.append(user)
+
+        # Record when the users were last needed, for evict_users
+        with self.connection:
+            self.connection.executemany('UPDATE users SET last_used = ? WHERE id = ?',
+                                        ((now, user_id) for user_id in fresh_ids))
+
+        return users, [user_id for user_id in user_ids if user_id not in fresh_ids]
+
+
+    def save_user_entries(self, users, spread=0):
+
+        # `users` maps each user ID to its user data, or to None if the user has been deleted
+        # Unlike save_users, the other cached users are kept
+        # Each entry's fetch time is moved back by a random amount of up to `spread` seconds, so 
+        # users that were requested together don't all expire (and get requested again) together
+        now = int(time.time())
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO users (id, data, fetched_at, last_used) '
+                'VALUES (?, ?, ?, ?)',
+                ((user_id, json.dumps(user), now - int(random.uniform(0, spread)), now) 
+                 for user_id, user in users.items()))
+
+
+    def evict_users(self, max_users):
+
+        # Remove the least recently used users, so the cache holds at most `max_users` users
+        user_count = self.connection.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        if user_count <= max_users:
+            return 0
+
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM users WHERE id IN '
+                '(SELECT id FROM users ORDER BY last_used ASC, id ASC LIMIT ?)',
+                (user_count - max_users,))
+
+        return user_count - max_users
+
+
+    def close(self):
+
+        self.connection.close()
+
+
+def question_in_scope(question, fromdate=None, todate=None, tagged=None):
+
+    # Same limits as the /questions endpoint: created between fromdate and todate (inclusive), 
+    # and with all of the tags
+    creation_date = question.get('creation_date', 0)
+    if fromdate and creation_date < fromdate:
+        return False
+    if todate and creation_date > todate:
+        return False
+    if tagged and not set(tagged).issubset(question.get('tags', [])):
+        return False
+
+    return True
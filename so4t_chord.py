@@ -0,0 +1,93 @@
+# Standard Python libraries
+import json
+import os
+
+
+# A self-contained chord diagram, drawn with d3 (loaded from its CDN, as d3blocks does)
+# The data is a square matrix: matrix[i][j] is the number of interactions from team i to team j
+CHORD_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Team interactions</title>
+<style>
+    body { font-family: sans-serif; margin: 0; }
+    .group text { font-size: 12px; }
+    .ribbons path { fill-opacity: 0.67; stroke: none; }
+    .ribbons path:hover { fill-opacity: 1; }
+</style>
+</head>
+<body>
+<div id="chord"></div>
+<script src="https://d3js.org/d3.v7.min.js"></script>
+<script>
+const data = __CHORD_DATA__;
+const width = 1000;
+const height = 1000;
+const outerRadius = Math.min(width, height) / 2 - 150;
+const innerRadius = outerRadius - 20;
+
+const color = d3.scaleOrdinal(data.teams, d3.schemeSet1.concat(d3.schemeSet3));
+const chord = d3.chordDirected()
+    .padAngle(10 / innerRadius)
+    .sortSubgroups(d3.descending)
+    .sortChords(d3.descending);
+const arc = d3.arc().innerRadius(innerRadius).outerRadius(outerRadius);
+const ribbon = d3.ribbonArrow().radius(innerRadius - 1).padAngle(1 / innerRadius);
+const chords = chord(data.matrix);
+
+const svg = d3.select('#chord').append('svg')
+    .attr('viewBox', [-width / 2, -height / 2, width, height])
+    .attr('width', width)
+    .attr('height', height);
+
+const group = svg.append('g').attr('class', 'group')
+    .selectAll('g')
+    .data(chords.groups)
+    .join('g');
+group.append('path')
+    .attr('fill', d => color(data.teams[d.index]))
+    .attr('d', arc);
+group.append('title')
+    .text(d => data.teams[d.index] + '\\n' +
+          d3.sum(data.matrix[d.index]) + ' outgoing\\n' +
+          d3.sum(data.matrix, row => row[d.index]) + ' incoming');
+group.append('text')
+    .each(d => { d.angle = (d.startAngle + d.endAngle) / 2; })
+    .attr('dy', '0.35em')
+    .attr('transform', d => 'rotate(' + (d.angle * 180 / Math.PI - 90) + ') ' +
+          'translate(' + (outerRadius + 5) + ')' + (d.angle > Math.PI ? ' rotate(180)' : ''))
+    .attr('text-anchor', d => d.angle > Math.PI ? 'end' : null)
+    .text(d => data.teams[d.index]);
+
+svg.append('g').attr('class', 'ribbons')
+    .selectAll('path')
+    .data(chords)
+    .join('path')
+    .attr('d', ribbon)
+    .attr('fill', d => color(data.teams[d.source.index]))
+    .append('title')
+    .text(d => data.teams[d.source.index] + ' \\u2192 ' + data.teams[d.target.index] + ': ' +
+          d.source.value);
+</script>
+</body>
+</html>
+'''
+
+
+def write_chord_diagram(teams, matrix, file_name='chord_diagram.html'):
+
+    filepath = os.path.join(os.getcwd(), file_name)
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(get_chord_html(teams, matrix))
+
+    return filepath
+
+
+def get_chord_html(teams, matrix):
+
+    # `teams` are the row and column labels of the square `matrix` (a list of lists of counts)
+    # "</" is escaped, so a team name can't close the script element
+    chord_data = json.dumps({'teams': teams, 'matrix': matrix}).replace('</', '<\\/')
+
+    return CHORD_TEMPLATE.replace('__CHORD_DATA__', chord_data)
@@ -0,0 +1,135 @@
+# Standard Python libraries
+from collections import Counter
+
+# Third-party libraries
+import numpy as np
+import pandas as pd
+
+
+# Each row of the flattened questions is an answer or comment on a question (a question edge), or
+# a comment on an answer (an answer edge)
+QUESTION_EDGE = 0
+ANSWER_EDGE = 1
+
+
+def count_team_pairs_columnar(questions, user_teams, pair_counts=None):
+
+    # Same results as create_interaction_data followed by count_team_pairs, but the nested
+    # questions are flattened once into columns of user IDs, and the rest (team lookups, the
+    # filtering rules, de-duplication, and counting) is done on whole columns at once
+    # `user_teams` maps each user ID to its team, as in LookupIndex
+    # Returns the team pair counts and the number of interactions not tracked due to deleted users
+    edges = flatten_questions(questions)
+    teams, team_codes = get_team_codes(user_teams)
+    source_users = edges['source_user']
+    other_users = edges['other_user']
+    source_teams = team_codes(source_users)
+    other_teams = team_codes(other_users)
+
+    # The rules from create_post_interaction and add_user_and_team:
+    # - comments on an answer by the question's owner are not counted (unless the answer's owner
+    #   was deleted, as count_untracked_interactions doesn't check for them)
+    # - deleted users (ID 0 here) can't be tracked, nor can posts from deleted users
+    # - users don't interact with their own posts, and each user counts once per post
+    # - users without a team can't be tracked
+    counted = ((edges['edge_type'] == QUESTION_EDGE) | (other_users != edges['question_user'])
+               | (source_users == 0))
+    deleted_users = counted & (other_users == 0)
+    user_edges = pd.DataFrame({
+        'edge_type': edges['edge_type'],
+        'post': edges['post'],
+        'other_user': other_users,
+        'source_user': source_users,
+        'source_team': source_teams,
+        'other_team': other_teams
+    })[counted & (other_users != 0) & (other_users != source_users)]
+    user_edges = user_edges.drop_duplicates(['edge_type', 'post', 'other_user'])
+
+    untracked = (user_edges['source_user'] == 0) | (user_edges['other_team'] < 0)
+    untracked_interactions = int(deleted_users.sum()) + int(untracked.sum())
+
+    # Each post counts once for every distinct team that interacted with it
+    team_edges = user_edges[~untracked & (user_edges['source_team'] >= 0)]
+    team_edges = team_edges.drop_duplicates(['edge_type', 'post', 'other_team'])
+    counts = team_edges.groupby(['edge_type', 'source_team', 'other_team']).size()
+
+    if pair_counts is None:
+        pair_counts = Counter()
+    for (edge_type, source_team, other_team), count in counts.items():
+        if edge_type == QUESTION_EDGE:
+            # the question's team is the source; answering/commenting teams are the targets
+            pair_counts[(teams[source_team], teams[other_team])] += int(count)
+        else:
+            # the commenting teams are the sources; the answer's team is the target
+            pair_counts[(teams[other_team], teams[source_team])] += int(count)
+
+    return pair_counts, untracked_interactions
+
+
+def flatten_questions(questions):
+
+    # One row for each answer or comment on a question (the question's owner is the source user),
+    # and each comment on an answer (the answer's owner is the source user)
+    # `post` numbers the questions and answers; deleted users, which have no user_id, get an ID of 0
+    # Only the user IDs are collected while walking the questions; the owners of each row's
+    # question and answer are filled in afterwards from the per-post columns
+    question_owners = []
+    answer_owners = []
+    answer_questions = []
+    question_posts = []
+    question_others = []
+    answer_posts = []
+    answer_others = []
+    answer_number = 0
+    for question_number, question in enumerate(questions):
+        question_owners.append(question['owner'].get('user_id') or 0)
+        for answer in question.get('answers', ()):
+            answer_owner = answer['owner'].get('user_id') or 0
+            answer_owners.append(answer_owner)
+            answer_questions.append(question_number)
+            question_posts.append(question_number)
+            question_others.append(answer_owner)
+            for comment in answer.get('comments', ()):
+                answer_posts.append(answer_number)
+                answer_others.append(comment['owner'].get('user_id') or 0)
+            answer_number += 1
+        for comment in question.get('comments', ()):
+            question_posts.append(question_number)
+            question_others.append(comment['owner'].get('user_id') or 0)
+
+    question_owners = np.array(question_owners, dtype=np.int64)
+    answer_owners = np.array(answer_owners, dtype=np.int64)
+    answer_questions = np.array(answer_questions, dtype=np.int64)
+    question_posts = np.array(question_posts, dtype=np.int64)
+    answer_posts = np.array(answer_posts, dtype=np.int64)
+    question_source_users = question_owners[question_posts]
+
+    return {
+        'edge_type': np.concatenate([np.full(len(question_posts), QUESTION_EDGE, dtype=np.int8),
+                                     np.full(len(answer_posts), ANSWER_EDGE, dtype=np.int8)]),
+        'post': np.concatenate([question_posts, answer_posts]),
+        'source_user': np.concatenate([question_source_users, answer_owners[answer_posts]]),
+        'other_user': np.concatenate([np.array(question_others, dtype=np.int64),
+                                      np.array(answer_others, dtype=np.int64)]),
+        'question_user': np.concatenate([question_source_users,
+                                         question_owners[answer_questions[answer_posts]]])
+    }
+
+
+def get_team_codes(user_teams):
+
+    # Gives each team an integer code, and returns the team names along with a function that
+    # looks up the team codes for a column of user IDs (-1 for users without a team)
+    teams = sorted({team for team in user_teams.values() if team})
+    codes = {team: code for code, team in enumerate(teams)}
+    user_ids = pd.Index(np.fromiter(user_teams.keys(), dtype=np.int64, count=len(user_teams)))
+    user_codes = np.fromiter((codes.get(team, -1) if team else -1
+                              for team in user_teams.values()),
+                             dtype=np.int64, count=len(user_teams))
+    user_codes = np.append(user_codes, -1) # for users that aren't in user_teams
+
+    def team_codes(user_column):
+        positions = user_ids.get_indexer(user_column) # -1 if not found
+        return user_codes[positions]
+
+    return teams, team_codes
@@ -0,0 +1,187 @@
+# Standard Python libraries
+import gzip
+import json
+import os
+import shutil
+import textwrap
+
+
+# 'json' is a single, indented JSON array, which is easy to read
+# 'jsonl.gz' is gzip-compressed, newline-delimited JSON (one item per line), which is much smaller
+# and faster to write and reload
+EXPORT_FORMATS = ['json', 'jsonl.gz']
+
+
+def export_data(data_name, data, export_format='json'):
+
+    with open_export(data_name, export_format) as writer:
+        for item in data:
+            writer.write(item)
+
+
+def export_pages(data_name, pages, export_format='json'):
+
+    # Generator that exports each page of items as it passes through, without holding all of the
+    # pages in memory
+    with open_export(data_name, export_format) as writer:
+        for page in pages:
+            for item in page:
+                writer.write(item)
+            yield page
+
+
+def open_export(data_name, export_format='json'):
+
+    if export_format == 'jsonl.gz':
+        return JsonLinesWriter(data_name)
+    else:
+        return JsonArrayWriter(data_name)
+
+
+def export_shard(file_name, data, export_format='json'):
+
+    # Writes part of an export (e.g. from a worker process), to be joined in order with the other 
+    # parts by join_shards. Returns the number of items written.
+    item_count = 0
+    if export_format == 'jsonl.gz':
+        with gzip.open(file_name, 'wt', encoding='utf-8', compresslevel=6) as f:
+            for item in data:
+                f.write(format_line(item))
+                item_count += 1
+    else:
+        with open(file_name, 'w') as f:
+            for item in data:
+                if item_count:
+                    f.write(',\n')
+                f.write(format_array_item(item))
+                item_count += 1
+
+    return item_count
+
+
+def join_shards(data_name, shard_files, item_counts, export_format='json'):
+
+    # Joins the parts written by export_shard into the same file that export_data would write
+    # Gzip files can simply be concatenated; the parts of a JSON array are joined with commas
+    file_name = f"{data_name}.{export_format}"
+    with open(file_name, 'wb') as f:
+        if export_format != 'jsonl.gz':
+            f.write(b'[\n' if sum(item_counts) else b'[]')
+        first_shard = True
+        for shard_file, item_count in zip(shard_files, item_counts):
+            if item_count:
+                if export_format != 'jsonl.gz' and not first_shard:
+                    f.write(b',\n')
+                with open(shard_file, 'rb') as shard:
+                    shutil.copyfileobj(shard, f)
+                first_shard = False
+            os.remove(shard_file)
+        if export_format != 'jsonl.gz' and sum(item_counts):
+            f.write(b'\n]')
+    print(f"'{file_name}' has been created in the current working directory.")
+
+
+def format_array_item(item):
+
+    # Same as an item of json.dump(data, f, indent=4)
+    return textwrap.indent(json.dumps(item, indent=4), ' ' * 4)
+
+
+def format_line(item):
+
+    return json.dumps(item, separators=(',', ':')) + '\n'
+
+
+def load_data(data_name, export_format='json'):
+
+    data = []
+    for page in get_data_pages(data_name, export_format):
+        data += page
+
+    return data
+
+
+def get_data_pages(data_name, export_format='json', page_size=100):
+
+    # Generator that yields previously exported data a page at a time
+    # Newline-delimited JSON is read incrementally; a JSON array has to be read in full first
+    file_name = f"{data_name}.{export_format}"
+    print(f"Loading '{file_name}' from the current working directory...")
+    if export_format == 'jsonl.gz':
+        page = []
+        with gzip.open(file_name, 'rt', encoding='utf-8') as f:
+            for line in f:
+                page.append(json.loads(line))
+                if len(page) == page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+    else:
+        with open(file_name, 'r') as f:
+            data = json.load(f)
+        for i in range(0, len(data), page_size):
+            yield data[i:i + page_size]
+
+
+# Writes a JSON array one item at a time, so the whole array doesn't need to be in memory
+# The file is formatted the same as json.dump(data, f, indent=4)
+class JsonArrayWriter(object):
+
+    def __init__(self, data_name):
+
+        self.file_name = f"{data_name}.json"
+        self.file = open(self.file_name, 'w')
+        self.item_count = 0
+
+
+    def write(self, item):
+
+        if self.item_count:
+            self.file.write(',\n')
+        else:
+            self.file.write('[\n')
+        self.file.write(format_array_item(item))
+        self.item_count += 1
+
+
+    def close(self):
+
+        if self.item_count:
+            self.file.write('\n]')
+        else:
+            self.file.write('[]')
+        self.file.close()
+        print(f"'{self.file_name}' has been created in the current working directory.")
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+
+# Writes gzip-compressed, newline-delimited JSON: one compact JSON object per line
+class JsonLinesWriter(JsonArrayWriter):
+
+    def __init__(self, data_name):
+
+        self.file_name = f"{data_name}.jsonl.gz"
+        self.file = gzip.open(self.file_name, 'wt', encoding='utf-8', compresslevel=6)
+        self.item_count = 0
+
+
+    def write(self, item):
+
+        self.file.write(format_line(item))
+        self.item_count += 1
+
+
+    def close(self):
+
+        self.file.close()
+        print(f"'{self.file_name}' has been created in the current working directory.")
@@ -5,27 +5,70 @@ If you run into difficulties, reach out to the person who provided you with this
 
 # Standard library imports
 import argparse
-import json
+import calendar
+import csv
+import multiprocessing
 import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-# Third-party library imports
-import pandas as pd
-from d3blocks import D3Blocks
+# Third-party libraries (numpy, pandas, and d3blocks) are imported by the functions that use 
+# them, since they take seconds to import and aren't needed for --help or --fetch-only
 
 # Local libraries
 from so4t_api_v2 import V2Client
 from so4t_api_v3 import V3Client
+from so4t_cache import DataCache
+from so4t_chord import write_chord_diagram
+from so4t_export import (EXPORT_FORMATS, export_data, export_pages, export_shard, get_data_pages,
+                         join_shards, load_data, open_export)
+from so4t_metrics import metrics
+from so4t_transport import CheckpointTransport, RecordingTransport, ReplayTransport, Transport
 
 
 def main():
 
     args = get_args()
-    users, questions = data_collector(args)
-    interaction_matrix = data_processor(users, questions)
-    create_chord_diagram(interaction_matrix)
+    run(args)
 
 
-def get_args():
+def run(args):
+
+    # Runs the whole script for one site; also used by so4t_batch.py for each site in a batch
+    # Returns the number of interactions between each pair of teams, or None with --fetch-only
+    metrics.profile = args.profile
+    try:
+        if args.from_snapshot:
+            with metrics.stage('load_snapshot'):
+                users, questions, tag_smes = snapshot_loader(args)
+        else:
+            users, questions, tag_smes = data_collector(args)
+        if args.fetch_only:
+            fetch_only(args, questions)
+            return None
+        if args.stream: # with streaming, the questions are received from the API in this stage
+            with metrics.stage('stream_processor'):
+                pair_counts = stream_processor(users, questions, args.export_format, 
+                                               args.monthly, tag_smes, args.sparse)
+        else:
+            pair_counts = data_processor(users, questions, args.processes, args.export_format,
+                                         args.monthly, tag_smes, args.sparse, args.engine)
+        with metrics.stage('create_chord_diagram'):
+            create_chord_diagram(prune_team_pairs(pair_counts, args.top_k, args.min_weight), 
+                                 args.renderer)
+    finally: # also export the metrics if the script stops early
+        if args.metrics:
+            metrics.export(args.metrics)
+
+    return pair_counts
+
+
+def get_args(argv=None):
 
     parser = argparse.ArgumentParser(
         prog='so4t_interactions.py',
@@ -48,41 +91,348 @@ def get_args():
                         help='API key. Only required for Stack Overflow Enterprise sites')
     parser.add_argument('--team-rename',
                         type=str,
-                        help='CSV file containing changes to team names. Not to be used with '
-                        '--remove-team-numbers')
+                        help='CSV file containing changes to team names. Can be used with '
+                        '--remove-team-numbers and --team-regex, which apply to teams that are '
+                        'not renamed')
     parser.add_argument('--remove-team-numbers',
                         action='store_true',
-                        help='Remove team numbers from team names. Not to be used with '
-                        '--team-rename')
+                        help='Remove team numbers from team names')
+    parser.add_argument('--team-regex',
+                        nargs=2,
+                        action='append',
+                        metavar=('PATTERN', 'REPLACEMENT'),
+                        help='Replace matches of a regular expression in team names. Can be used '
+                        'more than once; rules are applied in order')
+    parser.add_argument('--since',
+                        type=parse_date,
+                        help='Only include questions created on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--until',
+                        type=parse_date,
+                        help='Only include questions created on or before this date (YYYY-MM-DD)')
+    parser.add_argument('--tags',
+                        type=lambda value: [tag.strip() for tag in value.split(',')],
+                        help='Comma-separated list of tags. Only include questions with all of '
+                        'these tags')
+    parser.add_argument('--monthly',
+                        action='store_true',
+                        help='In addition to the overall interaction matrix, create an interaction '
+                        'matrix for each month, based on when the questions were created')
+    parser.add_argument('--smes',
+                        action='store_true',
+                        help='Also request the subject matter experts (SMEs) for every tag and '
+                        'create sme_matrix.csv, which counts questions from each team on tags '
+                        'with SMEs from each team')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help='Number of API pages to request in parallel. Default: 1')
+    parser.add_argument('--time-slices',
+                        type=int,
+                        default=0,
+                        help='Split the questions into about this many time slices (by creation '
+                        'date) of a similar size, and request each slice separately, in parallel '
+                        'with --workers. Speeds up requesting all questions on large sites')
+    parser.add_argument('--lean-filter',
+                        action='store_true',
+                        help='Only request (and keep) the question, answer, and comment fields '
+                        'needed to create the interactions, which reduces the data transferred')
+    parser.add_argument('--pool-size',
+                        type=int,
+                        default=10,
+                        help='Maximum number of open (keep-alive) connections to the API. '
+                        'Default: 10')
+    parser.add_argument('--max-retries',
+                        type=int,
+                        default=5,
+                        help='Number of times to retry an API call that was throttled or failed '
+                        'temporarily. Default: 5')
+    parser.add_argument('--timeout',
+                        type=float,
+                        nargs=2,
+                        default=[10, 120],
+                        metavar=('CONNECT', 'READ'),
+                        help='Seconds to wait for a connection to the API, and for a response, '
+                        'before the API call is retried. Default: 10 120')
+    parser.add_argument('--cache-dir',
+                        type=str,
+                        help='Directory in which to cache API data between runs. After the first '
+                        'run, only questions with new activity are requested from the API')
+    parser.add_argument('--full-sync-days',
+                        type=float,
+                        default=7,
+                        help='With --cache-dir, request all questions again if the last full '
+                        'download was more than this many days ago, to pick up new comments '
+                        '(which are not counted as activity). 0 requests all questions on this '
+                        'run. Default: 7')
+    parser.add_argument('--user-ttl',
+                        type=float,
+                        default=0,
+                        help='Only request the users in the questions, and only if they are not '
+                        'in the cache or were cached more than this many hours ago. Requires '
+                        '--cache-dir')
+    parser.add_argument('--user-cache-size',
+                        type=int,
+                        default=100000,
+                        help='With --user-ttl, the maximum number of users to keep in the cache. '
+                        'The least recently used users are removed first. Default: 100000')
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='Process questions a page at a time as they are received, rather than '
+                        'holding all of them in memory. Recommended for very large sites')
+    parser.add_argument('--processes',
+                        type=int,
+                        default=1,
+                        help='Number of processes to use when turning questions into interactions. '
+                        'Not used with --stream. Default: 1')
+    parser.add_argument('--engine',
+                        choices=['python', 'columnar'],
+                        default='python',
+                        help='How questions are turned into team interactions. "columnar" uses '
+                        'pandas to process all posts at once, which is much faster for large '
+                        'sites, but does not export interaction_data. Not used with --stream or '
+                        '--processes. Default: python')
+    parser.add_argument('--export-format',
+                        choices=EXPORT_FORMATS,
+                        default='json',
+                        help='File format for the exported users, questions, and interaction data. '
+                        '"jsonl.gz" (compressed, one item per line) is much smaller and faster. '
+                        'Default: json')
+    parser.add_argument('--fetch-only',
+                        action='store_true',
+                        help='Only request and export the data from the API, without processing '
+                        'it. The data can be processed later with --from-snapshot')
+    parser.add_argument('--renderer',
+                        choices=['d3blocks', 'builtin'],
+                        default='d3blocks',
+                        help='How to create the chord diagram. "builtin" writes the diagram '
+                        'from a template, without d3blocks. Default: d3blocks')
+    parser.add_argument('--sparse',
+                        action='store_true',
+                        help='Only export interaction_links.csv (one row for each pair of teams '
+                        'with interactions), not the full interaction_matrix.csv')
+    parser.add_argument('--top-k',
+                        type=int,
+                        default=0,
+                        help='Only show the given number of largest team-to-team links in the '
+                        'chord diagram. The exported files are not affected')
+    parser.add_argument('--min-weight',
+                        type=int,
+                        default=1,
+                        help='Only show team-to-team links with at least this many interactions '
+                        'in the chord diagram. The exported files are not affected. Default: 1')
+    parser.add_argument('--from-snapshot',
+                        action='store_true',
+                        help='Instead of calling the API, load the users and questions exported by '
+                        'a previous run (in --export-format) from the current directory')
+    parser.add_argument('--record',
+                        type=str,
+                        help='Save every API response to this file, so the run can be replayed '
+                        'later with --replay')
+    parser.add_argument('--replay',
+                        type=str,
+                        help='Serve API responses from a file created with --record, instead of '
+                        'calling the API. Use the same arguments as the recorded run')
+    parser.add_argument('--checkpoint',
+                        type=str,
+                        help='Save each page received from the API to this file as soon as it '
+                        'arrives, so that an interrupted run can be continued with --resume')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Continue an interrupted run, using the pages already saved in the '
+                        '--checkpoint file rather than requesting them again')
+    parser.add_argument('--metrics',
+                        type=str,
+                        help='Save timings and counters for each stage of the script (e.g. API '
+                        'calls, bytes received, and time spent waiting on backoff) to this JSON file')
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Profile each stage of the script with cProfile, saving the stats to '
+                        'profile_STAGE.prof files in the current directory')
+
+    return parser.parse_args(argv)
+
 
-    return parser.parse_args()
+def parse_date(value):
+
+    # Convert a YYYY-MM-DD date to Unix epoch time (UTC), which is what the API uses
+    try:
+        return calendar.timegm(time.strptime(value, '%Y-%m-%d'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a valid date. Use YYYY-MM-DD")
 
 
 def data_collector(args):
 
-    # Create API clients
-    v2client = V2Client(args)
-    v3client = V3Client(args)
+    if args.user_ttl and not args.cache_dir:
+        print("--user-ttl requires --cache-dir.")
+        raise SystemExit
 
-    # Get user data
-    if args.team_rename:
-        team_rename = pd.read_csv(args.team_rename)
-        team_rename = team_rename.set_index('old_team_name').to_dict()['new_team_name']
-        users = get_user_data(v3client, team_rename=team_rename)
-    elif args.remove_team_numbers:
-        users = get_user_data(v3client, team_numbers=False)
-    else: # if no team rename file is provided
-        users = get_user_data(v3client)
+    v2client, v3client = get_api_clients(args)
+
+    # Optionally, cache API data on disk so that later runs only request what has changed
+    if args.cache_dir:
+        cache = DataCache(args.cache_dir, args.url)
+    else:
+        cache = None
+
+    # Get user data, and optionally the SMEs for each tag (requested at the same time)
+    # With --user-ttl, only the users in the questions are needed, so they are requested after the
+    # questions (see below)
+    if not args.user_ttl:
+        with metrics.stage('get_user_data') as stage:
+            users, tag_smes = get_tag_smes(args, v3client, include_users=True)
+            users = get_user_data(v3client, get_team_normalizer(args), cache=cache, users=users)
+            export_data('users', users, args.export_format)
+            stage['items'] = len(users)
+    else:
+        with metrics.stage('get_tag_smes'):
+            users, tag_smes = get_tag_smes(args, v3client, include_users=False)
 
     # Get question data
-    questions = get_question_data(v2client)
+    # When streaming, `questions` is a generator of question pages rather than a list, and the
+    # cache must stay open until it has been read
+    with metrics.stage('get_question_data') as stage:
+        questions = get_question_data(v2client, cache, stream=args.stream, 
+                                      scope=get_question_scope(args), 
+                                      time_slices=args.time_slices, lean=args.lean_filter,
+                                      full_sync_age=args.full_sync_days * 86400)
+
+        # Export the questions as a snapshot, so they can be processed again without the API
+        # (see --from-snapshot)
+        if args.stream:
+            questions = export_pages('questions', questions, args.export_format)
+        else:
+            export_data('questions', questions, args.export_format)
+            stage['items'] = len(questions)
+
+    if args.user_ttl:
+        with metrics.stage('get_user_data') as stage:
+            # When streaming, the questions haven't been read yet, but they are in the cache
+            if args.stream:
+                question_pages = cache.get_question_pages(**get_question_scope(args))
+            else:
+                question_pages = [questions]
+            user_ids = get_question_user_ids(question_pages)
+            if tag_smes:
+                user_ids.update(user_id for smes in tag_smes.values() for user_id in smes)
+            users = get_cached_user_data(v3client, cache, user_ids, args.user_ttl * 3600, 
+                                         args.user_cache_size, get_team_normalizer(args))
+            export_data('users', users, args.export_format)
+            stage['items'] = len(users)
+
+    if cache and not args.stream:
+        cache.close()
+
+    return users, questions, tag_smes
+
+
+def get_api_clients(args):
+
+    # Create API clients, sharing a pooled HTTP session and retry policy
+    pool_size = max(args.pool_size, args.workers)
+    if args.checkpoint and (args.record or args.replay):
+        print("--checkpoint cannot be used with --record or --replay.")
+        raise SystemExit
+    if args.resume and not args.checkpoint:
+        print("--resume requires --checkpoint.")
+        raise SystemExit
+
+    if args.replay:
+        transport = ReplayTransport(args.replay)
+    elif args.record:
+        transport = RecordingTransport(args.record, pool_size, args.max_retries, args.timeout)
+    elif args.checkpoint:
+        transport = CheckpointTransport(args.checkpoint, args.resume, pool_size, args.max_retries,
+                                        args.timeout)
+    else:
+        transport = Transport(pool_size, args.max_retries, args.timeout)
+    v2client = V2Client(args, transport)
+    v3client = V3Client(args, transport)
+
+    return v2client, v3client
+
+
+def fetch_only(args, questions):
+
+    if args.from_snapshot:
+        print("--fetch-only cannot be used with --from-snapshot.")
+        raise SystemExit
+
+    # When streaming, the questions are only requested (and exported) as the pages are read
+    if args.stream:
+        with metrics.stage('export_question_pages'):
+            for page in questions:
+                metrics.increment('questions', len(page))
+    print("Data has been exported. Use --from-snapshot to process it.")
+
+
+def get_question_scope(args):
+
+    # Limits on which questions are requested from the API, which reduces the data to transfer
+    # and process. --until includes the whole day.
+    scope = {}
+    if args.since:
+        scope['fromdate'] = args.since
+    if args.until:
+        scope['todate'] = args.until + 86399
+    if args.tags:
+        scope['tagged'] = args.tags
 
-    return users, questions
+    return scope
 
 
-def get_user_data(client, team_rename=None, team_numbers=True):
+def snapshot_loader(args):
+
+    # The exported users already have the team rules from the run that created them, so the 
+    # rules for this run are applied to the original team names instead
+    users = load_data('users', args.export_format)
+    get_team_normalizer(args).normalize_users(users)
+
+    # When streaming, `questions` is a generator of question pages, as it is in data_collector
+    if args.stream:
+        questions = get_data_pages('questions', args.export_format)
+    else:
+        questions = load_data('questions', args.export_format)
+
+    if args.smes:
+        tag_smes = {item['tag']: item['smes'] for item in load_data('tag_smes', args.export_format)}
+    else:
+        tag_smes = None
+
+    return users, questions, tag_smes
+
+
+def get_team_normalizer(args):
+
+    if args.team_rename:
+        team_rename = load_team_rename(args.team_rename)
+    else:
+        team_rename = None
+
+    return TeamNormalizer(team_rename, args.remove_team_numbers, args.team_regex)
 
-    users = client.get_all_users()
+
+def load_team_rename(file_name):
+
+    # The CSV file has two columns: old_team_name and new_team_name
+    team_rename = {}
+    with open(file_name, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        if not {'old_team_name', 'new_team_name'}.issubset(reader.fieldnames or []):
+            print(f"'{file_name}' must have 'old_team_name' and 'new_team_name' columns.")
+            raise SystemExit
+        for row in reader:
+            team_rename[row['old_team_name']] = row['new_team_name']
+
+    return team_rename
+
+
+def get_user_data(client, team_normalizer=None, cache=None, users=None):
+
+    if users is None: # the users may have already been requested (see --smes)
+        users = client.get_all_users()
+    if cache: # cache the users before any changes are made to their team names
+        cache.save_users(users)
 
     # Exclude users with an ID of less than 1 (i.e. Community user and user groups)
     users = [user for user in users if user['id'] > 1]
@@ -90,31 +440,230 @@ def get_user_data(client, team_rename=None, team_numbers=True):
     if 'soedemo' in client.api_url: # for internal testing environment
         users = [user for user in users if user['id'] > 28000]
 
-    if team_rename:
-        for user in users:
+    if team_normalizer:
+        team_normalizer.normalize_users(users)
+
+    return users
+
+
+class TeamNormalizer(object):
+
+    # Renames teams, applies regex rules, and removes team numbers. There are usually only a few 
+    # hundred distinct team names, so each name is normalized once and then looked up for every 
+    # user. Teams in the rename file are given their new name as-is; the regex rules and number 
+    # removal apply to all other teams.
+    def __init__(self, team_rename=None, remove_numbers=False, regex_rules=None):
+
+        self.team_rename = team_rename or {}
+        self.remove_numbers = remove_numbers
+        self.regex_rules = []
+        for pattern, replacement in regex_rules or []:
             try:
-                user['department'] = team_rename[user['department']]
-            except KeyError:
-                pass
-    elif team_numbers:
-        # Remove team numbers from the end of team names
-        # Examples: PM63 -> PM, Engineering 2.1 -> Engineering
+                self.regex_rules.append((re.compile(pattern), replacement))
+            except re.error as error:
+                print(f"Invalid --team-regex pattern '{pattern}': {error}")
+                raise SystemExit
+        self.teams = {}
+
+
+    def normalize_users(self, users):
+
+        # When a team name is changed, the original is kept as 'original_department', so that a
+        # snapshot can be processed again with other rules (see --from-snapshot)
         for user in users:
-            try:
-                while not user['department'][-1].isalpha():
-                    user['department'] = user['department'][:-1]
-            except TypeError: # if user['department'] is None
-                pass
+            if 'department' in user:
+                team = user.pop('original_department', user['department'])
+                user['department'] = self.normalize(team)
+                if user['department'] != team:
+                    user['original_department'] = team
 
-    export_to_json('users', users)
 
-    return users
+    def normalize(self, team):
+
+        if team is None:
+            return None
+        try:
+            return self.teams[team]
+        except KeyError:
+            normalized_team = sys.intern(self.normalize_team(team))
+            self.teams[team] = normalized_team
+            return normalized_team
+
+
+    def normalize_team(self, team):
+
+        if team in self.team_rename:
+            return self.team_rename[team]
+
+        for pattern, replacement in self.regex_rules:
+            team = pattern.sub(replacement, team)
+
+        if self.remove_numbers:
+            team = remove_team_number(team)
 
+        return team
 
-def get_question_data(client):
+
+def remove_team_number(team):
+
+    # Remove team numbers from the end of team names
+    # Examples: PM63 -> PM, Engineering 2.1 -> Engineering
+    # Names without any letters (e.g. "2024") are left as they are
+    end = len(team)
+    while end and not team[end - 1].isalpha():
+        end -= 1
+
+    return team[:end] or team
+
+
+def get_tag_smes(args, client, include_users=True):
+
+    if not args.smes:
+        return None, None
+
+    users, tag_smes = client.get_users_and_tag_smes(include_users)
+    export_data('tag_smes', get_tag_sme_items(tag_smes), args.export_format)
+
+    return users, tag_smes
+
+
+# With --user-ttl, the number of users that can be requested one at a time for the cost of one page
+# of the full user list
+USER_REQUESTS_PER_PAGE = 10
+
+
+def get_cached_user_data(client, cache, user_ids, max_age, max_users, team_normalizer=None):
+
+    # Instead of requesting every user, only request the users that are needed (i.e. in the 
+    # questions) and are missing from the cache or were cached more than `max_age` seconds ago
+    users, stale_user_ids = cache.get_users(sorted(user_ids), max_age)
+    print(f"{len(users)} users found in the cache; requesting {len(stale_user_ids)} new or "
+          f"expired users")
+    if stale_user_ids:
+        # One request per user only pays off while few users are needed. Once they are more than
+        # a tenth of the site's users, the full user list (100 users per page) takes fewer requests.
+        if (len(stale_user_ids) > USER_REQUESTS_PER_PAGE 
+                and len(stale_user_ids) * USER_REQUESTS_PER_PAGE > client.get_user_count()):
+            print("Requesting the full user list instead")
+            all_users = {normalize_id(user['id']): user for user in client.get_all_users()}
+            # Users who aren't in the list have been deleted
+            requested_users = {user_id: all_users.get(user_id) for user_id in stale_user_ids}
+            cache.save_user_entries({**all_users, **requested_users}, spread=max_age / 2)
+        else:
+            requested_users = client.get_users_by_id(stale_user_ids)
+            cache.save_user_entries(requested_users, spread=max_age / 2)
+        users += [user for user in requested_users.values() if user]
+        deleted_users = sum(1 for user in requested_users.values() if not user)
+        if deleted_users:
+            print(f"{deleted_users} users have been deleted")
+    evicted_users = cache.evict_users(max_users)
+    if evicted_users:
+        print(f"{evicted_users} least recently used users removed from the cache")
+
+    users.sort(key=lambda user: user['id'])
+
+    return get_user_data(client, team_normalizer, users=users)
+
+
+def get_question_user_ids(question_pages):
+
+    # The IDs of the users who asked, answered, or commented on the questions
+    user_ids = set()
+    for questions in question_pages:
+        for question in questions:
+            posts = [question] + question.get('comments', [])
+            for answer in question.get('answers', []):
+                posts += [answer] + answer.get('comments', [])
+            for post in posts:
+                user_id = validate_user_id(post['owner'])
+                if user_id:
+                    user_ids.add(normalize_id(user_id))
+
+    return user_ids
+
+
+def get_tag_sme_items(tag_smes):
+
+    return [{'tag': tag, 'smes': smes} for tag, smes in tag_smes.items()]
+
+
+def get_question_data(client, cache=None, stream=False, scope={}, time_slices=0, lean=False,
+                      full_sync_age=7 * 86400):
+
+    filter_string = get_question_filter(client, cache, lean)
+
+    if not cache:
+        question_pages = get_question_pages(client, filter_string, scope, time_slices, lean)
+        if stream:
+            return question_pages
+        questions = [question for page in question_pages for question in page]
+        return questions
+
+    # Only request questions that have had activity since the last sync, then merge them into
+    # the cache. The sync time is taken before the API calls and, to allow for clock differences
+    # between this machine and the server, a few minutes of overlap is included.
+    # Each set of limits (--since, --until, --tags) has its own sync time, since a run with other
+    # limits hasn't requested the same questions
+    # New comments don't change a question's last_activity_date (and deleted questions aren't
+    # returned at all), so they are only picked up by requesting all of the questions again, once 
+    # the last full download is `full_sync_age` seconds old
+    sync_time = int(time.time())
+    sync_name = get_question_sync_name(scope)
+    last_sync = cache.get_last_sync(sync_name)
+    last_full_sync = cache.get_last_sync('full ' + sync_name)
+    full_sync = not (last_sync and last_full_sync and sync_time - last_full_sync < full_sync_age)
+    if not full_sync:
+        print(f"Getting questions with activity since the last sync ({time.ctime(last_sync)})")
+        question_pages = client.get_question_pages(filter_string, since=last_sync - 300, **scope)
+        if lean:
+            question_pages = (prune_questions(page) for page in question_pages)
+    else:
+        if last_sync:
+            print("Getting all questions, to pick up any new comments (see --full-sync-days)")
+        question_pages = get_question_pages(client, filter_string, scope, time_slices, lean)
+    new_question_count = 0
+    question_ids = set()
+    for page in question_pages:
+        cache.save_questions(page)
+        new_question_count += len(page)
+        if full_sync:
+            question_ids.update(question['question_id'] for question in page)
+    print(f"{new_question_count} new or updated questions saved to the cache")
+    if full_sync:
+        removed_question_count = cache.remove_other_questions(question_ids, **scope)
+        if removed_question_count:
+            print(f"{removed_question_count} deleted questions removed from the cache")
+        cache.set_last_sync('full ' + sync_name, sync_time)
+    cache.set_last_sync(sync_name, sync_time)
+
+    # The cache can also hold questions outside of the limits, from runs with other limits
+    if stream:
+        return cache.get_question_pages(**scope)
+    questions = cache.load_questions(**scope)
+
+    return questions
+
+
+def get_question_sync_name(scope):
+
+    # Without limits, the name is 'questions', as in caches from earlier versions
+    # Example: {'fromdate': 1696118400, 'tagged': ['python']} 
+    #   -> 'questions:fromdate=1696118400,tagged=python'
+    limits = []
+    for key in ['fromdate', 'todate', 'tagged']:
+        if scope.get(key):
+            value = ';'.join(sorted(scope[key])) if key == 'tagged' else scope[key]
+            limits.append(f"{key}={value}")
+
+    return 'questions:' + ','.join(limits) if limits else 'questions'
+
+
+def get_question_filter(client, cache=None, lean=False):
 
     # Create a filter to get additional data fields for questions/answers/comments
-    if client.soe: # For SO Enterprise, create a custom filter
+    if lean and client.soe: # only the fields needed to create the interactions
+        filter_string = get_lean_filter(client, cache)
+    elif client.soe: # For SO Enterprise, create a custom filter
         filter_attributes = [
             "answer.comment_count",
             "answer.comments",
@@ -130,106 +679,416 @@ def get_question_data(client):
     else: # As of 2023.08.14 filter creation is not working for SO Business
         filter_string = '!)Rm-Ag_bMMFYDy3UqfEQNPt7'
 
-    questions = client.get_all_questions(filter_string)
+    return filter_string
 
-    return questions
 
+def get_question_pages(client, filter_string, scope={}, time_slices=0, lean=False):
 
-def data_processor(users, questions):
+    if time_slices > 1:
+        question_pages = client.get_question_pages_by_time_slice(filter_string, time_slices, 
+                                                                 **scope)
+    else:
+        question_pages = client.get_question_pages(filter_string, **scope)
+
+    if lean:
+        question_pages = (prune_questions(page) for page in question_pages)
+
+    return question_pages
+
+
+def get_lean_filter(client, cache=None):
+
+    # Start from an empty filter ('none') and include only the fields used by 
+    # create_interaction_data, plus the dates used by --monthly, --time-slices, and --cache-dir.
+    # With an empty base, the fields of the response wrapper (e.g. has_more and backoff) need to 
+    # be included as well.
+    filter_attributes = [
+        ".backoff",
+        ".error_id",
+        ".error_message",
+        ".error_name",
+        ".has_more",
+        ".items",
+        "answer.answer_id",
+        "answer.comments",
+        "answer.owner",
+        "answer.question_id",
+        "comment.owner",
+        "question.answers",
+        "question.comments",
+        "question.creation_date",
+        "question.last_activity_date",
+        "question.owner",
+        "question.question_id",
+        "question.tags",
+        "shallow_user.user_id",
+    ]
+
+    # Filters don't change, so they are saved to the cache (if used) and reused on later runs
+    filter_name = 'lean:' + ';'.join(filter_attributes)
+    filter_string = cache.get_filter(filter_name) if cache else None
+    if not filter_string:
+        filter_string = client.create_filter(filter_attributes, base='none')
+        if cache:
+            cache.save_filter(filter_name, filter_string)
+
+    return filter_string
+
+
+def prune_questions(questions):
+
+    # Drop the fields that aren't used to create the interactions (see get_lean_filter), so they
+    # don't take up memory, or space in the exported files and cache
+    return [prune_question(question) for question in questions]
+
+
+def prune_question(question):
+
+    pruned_question = prune_post(question, ['question_id', 'owner', 'tags', 'creation_date', 
+                                            'last_activity_date'])
+    if 'answers' in question:
+        pruned_question['answers'] = [
+            prune_post(answer, ['answer_id', 'question_id', 'owner']) 
+            for answer in question['answers']]
+
+    return pruned_question
+
+
+def prune_post(post, fields):
+
+    pruned_post = {field: post[field] for field in fields if field in post}
+    if 'owner' in pruned_post:
+        pruned_post['owner'] = {key: value for key, value in post['owner'].items() 
+                                if key == 'user_id'}
+    if 'comments' in post:
+        pruned_post['comments'] = [prune_post(comment, ['owner']) for comment in post['comments']]
+
+    return pruned_post
+
+
+def data_processor(users, questions, processes=1, export_format='json', monthly=False,
+                   tag_smes=None, sparse=False, engine='python'):
+
+    if engine == 'columnar':
+        # The team pair counts are calculated directly from the questions, so there is no
+        # interaction data to export
+        from so4t_columnar import count_team_pairs_columnar
+
+        with metrics.stage('count_team_pairs_columnar') as stage:
+            pair_counts, untracked_interactions = count_team_pairs_columnar(
+                questions, LookupIndex(users).user_teams)
+            stage['items'] = len(questions)
+        interaction_data = None
+    elif processes > 1:
+        # The interaction data is exported by the worker processes
+        with metrics.stage('create_interaction_data') as stage:
+            interaction_count, untracked_interactions, pair_counts = \
+                create_interaction_data_in_parallel(questions, users, processes, export_format)
+            stage['items'] = interaction_count
+        interaction_data = None
+    else:
+        with metrics.stage('create_interaction_data') as stage:
+            # Build the user lookup once, rather than scanning the full list for every post
+            index = LookupIndex(users)
+            interaction_data, untracked_interactions = create_interaction_data(questions, index)
+            pair_counts = count_team_pairs(interaction_data)
+            stage['items'] = len(interaction_data)
+    print(f"Number of interactions not tracked due to deleted users: {untracked_interactions}")
+    metrics.increment('untracked_interactions', untracked_interactions)
+
+    if interaction_data is not None:
+        with metrics.stage('export_interaction_data'):
+            export_data('interaction_data', 
+                        (interaction.to_dict() for interaction in interaction_data), export_format)
+
+    with metrics.stage('create_interaction_matrix') as stage:
+        export_interaction_links(pair_counts)
+        if not sparse:
+            build_interaction_matrix(pair_counts)
+        stage['items'] = sum(pair_counts.values())
+
+    if monthly:
+        with metrics.stage('create_monthly_matrices'):
+            monthly_pair_counts = count_monthly_team_pairs(questions, LookupIndex(users))
+            create_monthly_matrices(monthly_pair_counts)
+
+    if tag_smes is not None:
+        with metrics.stage('create_sme_matrix'):
+            index = LookupIndex(users)
+            tag_sme_teams = get_tag_sme_teams(tag_smes, index)
+            sme_pair_counts = count_sme_team_pairs(questions, index, tag_sme_teams)
+            build_interaction_matrix(sme_pair_counts, 'sme_matrix.csv')
+
+    return pair_counts
+
+
+def create_interaction_data_in_parallel(questions, users, processes, export_format=None):
+
+    # Split the questions into contiguous shards and process them in a pool of worker processes.
+    # Only the team pair counts, untracked interactions, and number of interactions for each shard
+    # are sent back, since sending the interactions themselves would take longer than creating
+    # them. With `export_format`, each worker exports its own interactions to a file, and the files
+    # are joined in order, so the results are identical to create_interaction_data.
+    # Returns the number of interactions, the untracked interactions, and the team pair counts.
+    shard_count = processes * 4
+    shard_size = -(-len(questions) // shard_count) or 1 # round up
+    shards = [(i, min(i + shard_size, len(questions))) 
+              for i in range(0, len(questions), shard_size)]
+    print(f"Processing {len(questions)} questions in {len(shards)} shards "
+          f"across {processes} processes...")
+
+    # Forked workers already have the questions (see init_extraction_worker), so only the start 
+    # and end of each shard needs to be sent to them. Otherwise, each worker is sent all of the 
+    # questions once, when it starts.
+    global worker_questions
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        worker_questions = questions
+        initargs = (users, None)
+    else:
+        context = None
+        initargs = (users, questions)
+
+    if export_format:
+        export_dir = tempfile.mkdtemp(prefix='.interaction_data_', dir=os.getcwd())
+        shard_files = [os.path.join(export_dir, f"shard_{i}") for i in range(len(shards))]
+    else:
+        export_dir = None
+        shard_files = [None] * len(shards)
+    interaction_count = 0
+    item_counts = []
+    untracked_interactions = 0
+    pair_counts = Counter()
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, 
+                                 initializer=init_extraction_worker, initargs=initargs) as executor:
+            for shard_interactions, shard_untracked, shard_pair_counts in executor.map(
+                    extract_shard, shards, shard_files, [export_format] * len(shards)):
+                interaction_count += shard_interactions
+                item_counts.append(shard_interactions)
+                untracked_interactions += shard_untracked
+                pair_counts.update(shard_pair_counts)
+        if export_format:
+            join_shards('interaction_data', shard_files, item_counts, export_format)
+    finally:
+        worker_questions = None
+        if export_dir:
+            shutil.rmtree(export_dir, ignore_errors=True)
+
+    return interaction_count, untracked_interactions, pair_counts
+
+
+# The lookup index and questions for each worker process. The user -> team map is built once per 
+# worker (by the pool initializer) and only read afterwards. The questions are inherited from the 
+# parent process when workers are forked.
+worker_index = None
+worker_questions = None
+
+
+def init_extraction_worker(users, questions=None):
+
+    global worker_index, worker_questions
+    worker_index = LookupIndex(users)
+    if questions is not None:
+        worker_questions = questions
+
+
+def extract_shard(shard, shard_file=None, export_format=None):
+
+    # Answers are nested within their questions, so a shard always contains the original question
+    # needed for each of its answers
+    start, end = shard
+    interaction_data, untracked_interactions = create_interaction_data(
+        worker_questions[start:end], worker_index)
+    pair_counts = count_team_pairs(interaction_data)
+    if shard_file:
+        export_shard(shard_file, (interaction.to_dict() for interaction in interaction_data), 
+                     export_format)
+
+    return len(interaction_data), untracked_interactions, pair_counts
+
+
+def stream_processor(users, question_pages, export_format='json', monthly=False, tag_smes=None,
+                     sparse=False):
+
+    # Same results as data_processor, but questions are processed a page at a time and each page 
+    # is folded into the team pair counts, so memory use is bounded by the page size and the 
+    # number of teams rather than the number of questions
+    index = LookupIndex(users)
+    pair_counts = Counter()
+    monthly_pair_counts = defaultdict(Counter)
+    untracked_interactions = 0
+    if tag_smes is not None:
+        tag_sme_teams = get_tag_sme_teams(tag_smes, index)
+        sme_pair_counts = Counter()
+
+    with open_export('interaction_data', export_format) as interaction_writer:
+        for questions in question_pages:
+            # Answers are nested within their questions, so each page is processed on its own
+            interaction_data, untracked = create_interaction_data(questions, index)
+            untracked_interactions += untracked
+            metrics.increment('questions', len(questions))
+            metrics.increment('interactions', len(interaction_data))
+            count_team_pairs(interaction_data, pair_counts)
+            if monthly:
+                count_monthly_team_pairs(questions, index, monthly_pair_counts)
+            if tag_smes is not None:
+                count_sme_team_pairs(questions, index, tag_sme_teams, sme_pair_counts)
+            for interaction in interaction_data:
+                interaction_writer.write(interaction.to_dict())
 
-    interaction_data, untracked_interactions = create_interaction_data(questions, users, questions)
     print(f"Number of interactions not tracked due to deleted users: {untracked_interactions}")
-    export_to_json('interaction_data', interaction_data)
+    metrics.increment('untracked_interactions', untracked_interactions)
+    export_interaction_links(pair_counts)
+    if not sparse:
+        build_interaction_matrix(pair_counts)
+    if monthly:
+        create_monthly_matrices(monthly_pair_counts)
+    if tag_smes is not None:
+        build_interaction_matrix(sme_pair_counts, 'sme_matrix.csv')
 
-    interaction_matrix = create_interaction_matrix(interaction_data)
+    return pair_counts
 
-    return interaction_matrix
 
+def count_monthly_team_pairs(questions, index, monthly_pair_counts=None):
 
-# Should split this into smaller functions
-def create_interaction_data(content_list, users, questions):
+    # Tally team pairs separately for each month (YYYY-MM), based on when the question was created
+    # An interaction on an answer or comment counts toward the month of its question
+    if monthly_pair_counts is None:
+        monthly_pair_counts = defaultdict(Counter)
 
-    interaction_data = []
-    untracked_interactions = 0
+    questions_by_month = defaultdict(list)
+    for question in questions:
+        month = time.strftime('%Y-%m', time.gmtime(question['creation_date']))
+        questions_by_month[month].append(question)
 
-    for content in content_list:
-        interaction = {
-            'source_user': validate_user_id(content['owner']),
-            'source_team': None,
-            'interacting_users': [],
-            'interacting_teams': [],
-            'post_type': None,
-            'id': None,
-            'tags': None # only for questions
-        }
-        interaction['source_team'] = find_user_team(interaction['source_user'], users)
+    for month, month_questions in questions_by_month.items():
+        interaction_data, untracked = create_interaction_data(month_questions, index)
+        count_team_pairs(interaction_data, monthly_pair_counts[month])
 
-        # if there is no user_id, the user has been deleted; cannot properly track interactions
-        # tally untracked interactions, end the loop, and move on to the next content object
-        if not interaction['source_user']:
-            interaction_count = 0
+    return monthly_pair_counts
 
-            # this falsely assumes users can't answer their own questions
-            try:
-                interaction_count += len(content['answers'])
-            except KeyError: # if there are no answers
-                pass
 
-            # Need to verify comments are not from the source user to avoid double counting
-            # CAN USE NEW VALIDATE_USER_ID FUNCTION TO CHECK FOR DELETED USERS
-            try:
-                interaction_count += len(content['comments'])
-            except KeyError:
-                pass
-            untracked_interactions += interaction_count
+def create_monthly_matrices(monthly_pair_counts):
+
+    for month in sorted(monthly_pair_counts):
+        build_interaction_matrix(monthly_pair_counts[month], f"interaction_matrix_{month}.csv")
+
+
+def get_tag_sme_teams(tag_smes, index):
+
+    # Map each tag name to the teams of its SMEs, in order, skipping SMEs without a team
+    tag_sme_teams = {}
+    for tag, smes in tag_smes.items():
+        teams = (index.find_user_team(user_id) for user_id in smes)
+        tag_sme_teams[tag] = [team for team in dict.fromkeys(teams) if team]
+
+    return tag_sme_teams
+
+
+def count_sme_team_pairs(questions, index, tag_sme_teams, sme_pair_counts=None):
+
+    # Tally each question once for every team with an SME on (any of) the question's tags
+    # The asking team is the source; the SME teams are the targets
+    if sme_pair_counts is None:
+        sme_pair_counts = Counter()
+
+    for question in questions:
+        asking_team = index.find_user_team(validate_user_id(question['owner']))
+        if not asking_team:
             continue
 
-        try:
-            interaction['id'] = content['answer_id']
-            interaction['post_type'] = 'answer'
-        except KeyError: # if there is no answer_id, it's a question
-            interaction['id'] = content['question_id']
-            interaction['post_type'] = 'question'
-            interaction['tags'] = content['tags']
-
-        if interaction['post_type'] == 'answer':
-            original_question = find_original_question(content['question_id'], questions)
-            interaction['tags'] = original_question['tags']
-        else:
-            original_question = None
-        
-        try:
-            for answer in content['answers']:
-                interaction, untracked_interactions = add_user_and_team(
-                    interaction, answer, untracked_interactions, users)
-            
-            interactions, untracked = create_interaction_data(content['answers'], users, questions)
-            interaction_data += interactions
+        sme_teams = {}
+        for tag in question['tags']:
+            sme_teams.update(dict.fromkeys(tag_sme_teams.get(tag, [])))
+        for sme_team in sme_teams:
+            sme_pair_counts[(asking_team, sme_team)] += 1
+
+    return sme_pair_counts
+
+
+def create_interaction_data(content_list, index):
+
+    # Walks each question and then its answers in a single pass, without recursion. Each answer 
+    # is handed its question directly, rather than looking the question up again.
+    # Answers are listed before their question, as they always have been.
+    interaction_data = []
+    untracked_interactions = 0
+
+    for question in content_list:
+        for answer in question.get('answers', []):
+            interaction, untracked = create_post_interaction(answer, index, question)
             untracked_interactions += untracked
-        except KeyError: # if there are no answers
-            pass
-        
-        try:
-            for comment in content['comments']:
-                try:
-                    original_asker = validate_user_id(original_question['owner'])
-                    commenter = validate_user_id(comment['owner'])
-                    if original_asker == commenter:
-                        continue # do not record comment interactions from the question owner
-                except TypeError: # if comment is on a question, original_question will not exist
-                    pass
-                interaction, untracked_interactions = add_user_and_team(
-                    interaction, comment, untracked_interactions, users)
-        except KeyError: # if there are no comments
-            if interaction['post_type'] == 'answer': # do not record answers with no comments
-                continue
-            pass
-
-        interaction_data.append(interaction)
+            if interaction:
+                interaction_data.append(interaction)
+
+        interaction, untracked = create_post_interaction(question, index)
+        untracked_interactions += untracked
+        if interaction:
+            interaction_data.append(interaction)
 
     return interaction_data, untracked_interactions
 
 
+def create_post_interaction(content, index, question=None):
+
+    # Returns the interaction for a question (or, if `question` is given, one of its answers), 
+    # along with the number of interactions on it that can't be tracked
+    interaction = Interaction(validate_user_id(content['owner']))
+
+    # if there is no user_id, the user has been deleted; cannot properly track interactions
+    if not interaction.source_user:
+        return None, count_untracked_interactions(content)
+
+    interaction.source_team = index.find_user_team(interaction.source_user)
+    if question is None:
+        interaction.id = content['question_id']
+        interaction.post_type = 'question'
+        interaction.tags = content['tags']
+    else:
+        interaction.id = content['answer_id']
+        interaction.post_type = 'answer'
+        interaction.tags = question['tags']
+
+    untracked_interactions = 0
+    for answer in content.get('answers', []):
+        interaction, untracked_interactions = add_user_and_team(
+            interaction, answer, untracked_interactions, index)
+
+    if 'comments' not in content:
+        if question is not None: # do not record answers with no comments
+            return None, untracked_interactions
+        return interaction, untracked_interactions
+
+    if question is not None:
+        original_asker = validate_user_id(question['owner'])
+    for comment in content['comments']:
+        if question is not None and validate_user_id(comment['owner']) == original_asker:
+            continue # do not record comment interactions from the question owner
+        interaction, untracked_interactions = add_user_and_team(
+            interaction, comment, untracked_interactions, index)
+
+    return interaction, untracked_interactions
+
+
+def count_untracked_interactions(content):
+
+    # Interactions on a post from a deleted user can't be attributed to a team. Count them the 
+    # same way add_user_and_team does: once for each distinct user who answered or commented, 
+    # and once for each answer or comment from another deleted user.
+    interacting_users = set()
+    untracked_interactions = 0
+    for post in content.get('answers', []) + content.get('comments', []):
+        user = validate_user_id(post['owner'])
+        if not user:
+            untracked_interactions += 1
+        elif user not in interacting_users:
+            interacting_users.add(user)
+            untracked_interactions += 1
+
+    return untracked_interactions
+
+
 def validate_user_id(user):
     # If the user doesn't exist (e.g. deleted), the user_id will not be present
     # Likewise, the user_type will be "does_not_exist"
@@ -241,86 +1100,189 @@ def validate_user_id(user):
         return None
     
 
-def find_user_team(user_id, users):
-    # Since `users` is from API v3, it uses an 'id' key instead of 'user_id'
+def normalize_id(item_id):
+    # IDs can arrive as integers or strings depending on the API version and endpoint
+    # Normalize them to integers so lookups match regardless of the source
 
-    search_result = next((item for item in users if int(item['id']) == user_id), None)
-    try:
-        user_team = search_result['department']
-    except TypeError: # if None is returned from the search_result
-        user_team = search_result
+    if item_id is None:
+        return None
     
-    return user_team
+    return int(item_id)
 
 
-def find_original_question(question_id, questions):
+class Interaction(object):
 
-    search_result = next((item for item in questions if int(item['question_id']) == question_id), None)
-    
-    return search_result
+    # A compact record of the interactions on a single post. With __slots__, each record has no 
+    # per-instance __dict__, which adds up over millions of posts. Interacting users and teams are 
+    # kept as dicts (used as insertion-ordered sets), so duplicate checks don't scan a list.
+    __slots__ = ('source_user', 'source_team', 'interacting_users', 'interacting_teams',
+                 'post_type', 'id', 'tags')
+
+
+    def __init__(self, source_user):
+
+        self.source_user = source_user
+        self.source_team = None
+        self.interacting_users = {}
+        self.interacting_teams = {}
+        self.post_type = None
+        self.id = None
+        self.tags = None # only for questions
+
+
+    def to_dict(self):
+
+        # The exported shape of an interaction, with lists of interacting users and teams
+        return {
+            'source_user': self.source_user,
+            'source_team': self.source_team,
+            'interacting_users': list(self.interacting_users),
+            'interacting_teams': list(self.interacting_teams),
+            'post_type': self.post_type,
+            'id': self.id,
+            'tags': self.tags
+        }
+
+
+    def __eq__(self, other):
 
+        if not isinstance(other, Interaction):
+            return NotImplemented
 
-def add_user_and_team(interaction, content, untracked_interactions, users):
+        return self.to_dict() == other.to_dict()
+
+
+class LookupIndex(object):
+
+    def __init__(self, users):
+
+        # Since `users` is from API v3, it uses an 'id' key instead of 'user_id'
+        # Team names are interned, so every user and interaction shares one string per team
+        self.user_teams = {}
+        for user in users:
+            team = user.get('department')
+            if isinstance(team, str):
+                team = sys.intern(team)
+            self.user_teams[normalize_id(user['id'])] = team
+
+
+    def find_user_team(self, user_id):
+
+        return self.user_teams.get(normalize_id(user_id))
+
+
+def add_user_and_team(interaction, content, untracked_interactions, index):
 
-    source_user = interaction['source_user']
-    interacting_users = interaction['interacting_users']
     new_user = validate_user_id(content['owner'])
 
     if not new_user: # if the user has been deleted
         untracked_interactions += 1
     else:
-        if new_user != source_user and new_user not in interacting_users:
-            interaction['interacting_users'].append(new_user)
-            interacting_team = find_user_team(new_user, users)
+        if new_user != interaction.source_user and new_user not in interaction.interacting_users:
+            interaction.interacting_users[new_user] = None
+            interacting_team = index.find_user_team(new_user)
             if not interacting_team: # unable to properly track interaction if there is no team
                 untracked_interactions += 1
-            elif interacting_team not in interaction['interacting_teams']:
-                interaction['interacting_teams'].append(find_user_team(new_user, users))
+            else:
+                interaction.interacting_teams[interacting_team] = None
 
     return interaction, untracked_interactions
 
 
-def create_interaction_matrix(interaction_data):
+def count_team_pairs(interaction_data, pair_counts=None):
+
+    # Tally the number of interactions between each (source team, target team) pair
+    # `pair_counts` can be passed in to add to the counts from earlier interaction data
+    if pair_counts is None:
+        pair_counts = Counter()
 
-    matrix_data = []
     for interaction in interaction_data:
-        if interaction['post_type'] == 'question': # if it's a question
-            source_team = interaction['source_team']
-        else: # if it's an answer
-            target_team = interaction['source_team']
-        
-        for team in interaction['interacting_teams']:
-            if source_team: # if it's a question
-                matrix_data.append({
-                    'source': source_team,
-                    'target': team
-                })
-            else: # if it's an answer
-                matrix_data.append({
-                    'source': team,
-                    'target': target_team
-                })
-    
-    # create and format dataframe
-    interaction_matrix = pd.DataFrame(matrix_data).groupby(['source', 'target']).size()
-    interaction_matrix = interaction_matrix.reset_index(name='weight')
-    interaction_matrix = interaction_matrix.pivot(
-        index='source', columns='target', values='weight').fillna(0)
-    interaction_matrix = interaction_matrix.astype(int)
+        if not interaction.source_team: # unable to track interactions if there is no team
+            continue
+
+        for team in interaction.interacting_teams:
+            if interaction.post_type == 'question':
+                # the question's team is the source; answering/commenting teams are the targets
+                pair_counts[(interaction.source_team, team)] += 1
+            else:
+                # commenting teams are the source; the answer's team is the target
+                pair_counts[(team, interaction.source_team)] += 1
+
+    return pair_counts
+
+
+def build_interaction_matrix(pair_counts, file_name='interaction_matrix.csv'):
+
+    import numpy as np
+    import pandas as pd
+
+    # Map each team to an integer code once, then add the counts straight into a NumPy array
+    # Teams are sorted, so rows and columns are in the same order as a pandas pivot table
+    source_teams = sorted({source for source, target in pair_counts})
+    target_teams = sorted({target for source, target in pair_counts})
+    source_codes = {team: code for code, team in enumerate(source_teams)}
+    target_codes = {team: code for code, team in enumerate(target_teams)}
+
+    pair_count = len(pair_counts)
+    rows = np.fromiter((source_codes[source] for source, target in pair_counts), 
+                       dtype=np.intp, count=pair_count)
+    columns = np.fromiter((target_codes[target] for source, target in pair_counts), 
+                          dtype=np.intp, count=pair_count)
+    weights = np.fromiter(pair_counts.values(), dtype=np.int64, count=pair_count)
+
+    counts = np.zeros((len(source_teams), len(target_teams)), dtype=np.int64)
+    np.add.at(counts, (rows, columns), weights)
+
+    interaction_matrix = pd.DataFrame(counts, 
+                                      index=pd.Index(source_teams, name='source'),
+                                      columns=pd.Index(target_teams, name='target'))
     
     # export interaction matrix to csv
-    file_name = 'interaction_matrix.csv'
     interaction_matrix.to_csv(file_name)
     print(f"'{file_name}' has been created in the current working directory.")
 
     return interaction_matrix
 
 
-def create_chord_diagram(interaction_matrix):
+def export_interaction_links(pair_counts, file_name='interaction_links.csv'):
+
+    # The long form of the interaction matrix: one row for each (source, target) pair of teams 
+    # with interactions. Unlike the matrix, its size doesn't grow with the square of the number of 
+    # teams.
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['source', 'target', 'weight'])
+        for (source, target), weight in sorted(pair_counts.items()):
+            if weight:
+                writer.writerow([source, target, weight])
+    print(f"'{file_name}' has been created in the current working directory.")
+
+
+def prune_team_pairs(pair_counts, top_k=0, min_weight=1):
+
+    # Keep only the links worth drawing: those with at least `min_weight` interactions and, if 
+    # `top_k` is set, only the `top_k` largest of those (ties are broken by team names)
+    min_weight = max(1, min_weight)
+    pairs = [(pair, weight) for pair, weight in pair_counts.items() if weight >= min_weight]
+    if top_k and len(pairs) > top_k:
+        pairs = sorted(pairs, key=lambda item: (-item[1], item[0]))[:top_k]
+        print(f"Showing the {top_k} largest of {len(pair_counts)} team-to-team links")
+
+    return Counter(dict(pairs))
+
+
+def create_chord_diagram(pair_counts, renderer='d3blocks'):
+
+    if renderer == 'builtin':
+        teams, matrix = get_square_matrix(pair_counts)
+        write_chord_diagram(teams, matrix)
+        print("Chord diagram created. You can find it in the current working directory.")
+        return
+
+    from d3blocks import D3Blocks
 
     filepath = os.path.join(os.getcwd(), 'chord_diagram.html')
-    d3_data = interaction_matrix.stack().reset_index().rename(
-        columns={'level_0':'source','level_1':'target', 0:'weight'})
+    d3_data = pairs_to_links(pair_counts)
     
     d3 = D3Blocks()
     original_html = d3.chord(d3_data,
@@ -340,14 +1302,25 @@ def create_chord_diagram(interaction_matrix):
     print("Chord diagram created. You can find it in the current working directory.")
 
 
-def export_to_json(data_name, data):
+def get_square_matrix(pair_counts):
 
-    file_name = f"{data_name}.json"
+    # A chord diagram needs the same teams (in the same order) as both rows and columns
+    teams = sorted({team for pair in pair_counts for team in pair})
+    matrix = [[pair_counts.get((source, target), 0) for target in teams] for source in teams]
 
-    with open(file_name, 'w') as f:
-        json.dump(data, f, indent=4)
+    return teams, matrix
 
-    print(f"'{file_name}' has been created in the current working directory.")
+
+def pairs_to_links(pair_counts):
+
+    import pandas as pd
+
+    # The long form (source, target, weight) used by d3, sorted by source and target teams
+    # Teams without any interactions (zero-weight links) are left out, rather than drawn as empty
+    links = sorted((source, target, weight) for (source, target), weight in pair_counts.items() 
+                   if weight)
+
+    return pd.DataFrame(links, columns=['source', 'target', 'weight'])
 
 
 if __name__ == '__main__':
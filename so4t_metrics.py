@@ -0,0 +1,95 @@
+# Standard Python libraries
+import cProfile
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try: # the resource module is not available on Windows
+    import resource
+except ImportError:
+    resource = None
+
+
+class Metrics(object):
+
+    def __init__(self):
+
+        self.lock = threading.Lock() # counters are updated by multiple workers
+        self.profile = False
+        self.reset()
+
+
+    def reset(self):
+
+        # Starts over, e.g. for the next site in a batch (see so4t_batch.py)
+        self.stages = {}
+        self.counters = Counter()
+        self.start_time = time.perf_counter()
+
+
+    def increment(self, name, value=1):
+
+        with self.lock:
+            self.counters[name] += value
+
+
+    @contextmanager
+    def stage(self, name):
+
+        # Records the wall time of a stage and, optionally, profiles it with cProfile
+        # The stage can add details (e.g. the number of items processed) to the yielded dict
+        stage = {}
+        if self.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start_time = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage['seconds'] = round(time.perf_counter() - start_time, 3)
+            if self.profile:
+                profiler.disable()
+                stage['profile'] = f"profile_{name}.prof"
+                profiler.dump_stats(stage['profile'])
+            if stage.get('items') and stage['seconds']:
+                stage['items_per_second'] = round(stage['items'] / stage['seconds'], 1)
+            stage['peak_memory_mb'] = get_peak_memory()
+            self.stages[name] = stage
+            print(f"Stage '{name}' completed in {stage['seconds']} seconds")
+
+
+    def export(self, file_name):
+
+        report = {
+            'total_seconds': round(time.perf_counter() - self.start_time, 3),
+            'peak_memory_mb': get_peak_memory(),
+            'stages': self.stages,
+            'counters': dict(self.counters)
+        }
+        if report['total_seconds']:
+            report['api_requests_per_second'] = round(
+                self.counters['api_requests'] / report['total_seconds'], 2)
+
+        with open(file_name, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"'{file_name}' has been created in the current working directory.")
+
+
+def get_peak_memory():
+
+    # Peak resident memory of the process so far, in MB
+    if not resource:
+        return None
+
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # reported in bytes on macOS, and kilobytes on Linux
+        peak_memory /= 1024
+
+    return round(peak_memory / 1024, 1)
+
+
+# Shared by the API clients, transport, and processing functions for the duration of a run
+metrics = Metrics()
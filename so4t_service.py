@@ -0,0 +1,270 @@
+'''
+This Python script is offered with no formal support.
+If you run into difficulties, reach out to the person who provided you with this script.
+
+Keeps the interaction matrix for a site up to date in memory, and serves it over HTTP. After the
+first full download, only questions with new activity are requested (every --interval seconds),
+and the matrix is updated with the changes to those questions. All questions are requested
+again every --full-sync-days, since new comments are not counted as activity.
+'''
+
+# Standard library imports
+import argparse
+import csv
+import io
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local libraries
+from so4t_chord import get_chord_html
+from so4t_interactions import get_args as get_script_args
+from so4t_interactions import (LookupIndex, count_team_pairs, create_interaction_data,
+                               get_api_clients, get_question_filter, get_question_pages,
+                               get_question_scope, get_team_normalizer, get_user_data,
+                               normalize_id)
+
+
+def main():
+
+    service_args, script_args = get_args()
+    v2client, v3client = get_api_clients(script_args)
+    users = get_user_data(v3client, get_team_normalizer(script_args))
+    filter_string = get_question_filter(v2client, lean=script_args.lean_filter)
+    service = InteractionService(v2client, filter_string, LookupIndex(users),
+                                 get_question_scope(script_args), script_args.time_slices,
+                                 script_args.full_sync_days * 86400)
+
+    print("Getting all questions...")
+    service.update()
+
+    stop_polling = threading.Event()
+    poller = threading.Thread(target=service.poll, args=(service_args.interval, stop_polling),
+                              daemon=True)
+    poller.start()
+
+    server = ThreadingHTTPServer((service_args.host, service_args.port), ServiceRequestHandler)
+    server.service = service
+    print(f"Serving the interaction matrix at http://{service_args.host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        stop_polling.set()
+        server.server_close()
+
+
+def get_args():
+
+    # Arguments for the service itself. All other arguments (e.g. --url, --token, --key and
+    # --team-rename) are the same as for so4t_interactions.py
+    parser = argparse.ArgumentParser(
+        prog='so4t_service.py',
+        description='Serve an interaction matrix that is kept up to date with new activity. '
+        'Also takes the so4t_interactions.py arguments used to request the data, such as --url, '
+        '--token, and --key')
+    parser.add_argument('--host',
+                        type=str,
+                        default='127.0.0.1',
+                        help='Address to serve on. Default: 127.0.0.1 (this machine only)')
+    parser.add_argument('--port',
+                        type=int,
+                        default=8000,
+                        help='Port to serve on. Default: 8000')
+    parser.add_argument('--interval',
+                        type=int,
+                        default=300,
+                        help='Seconds between requests for questions with new activity. '
+                        'Default: 300')
+    service_args, remaining_args = parser.parse_known_args()
+
+    return service_args, get_script_args(remaining_args)
+
+
+class InteractionService(object):
+
+    def __init__(self, client, filter_string, index, scope={}, time_slices=0, 
+                 full_sync_age=7 * 86400):
+
+        self.client = client
+        self.filter_string = filter_string
+        self.index = index
+        self.scope = scope
+        self.time_slices = time_slices
+        self.full_sync_age = full_sync_age
+
+        # The team pair counts from each question (including its answers) are kept, so that when
+        # a question changes, its old counts can be subtracted before its new counts are added
+        self.question_pair_counts = {}
+        self.pair_counts = Counter()
+        self.last_sync = None
+        self.last_full_sync = None
+        self.lock = threading.Lock()
+
+        # The responses are created after each update, so requests are answered straight away
+        self.responses = {}
+        self.status = {'questions_with_interactions': 0, 'updates': 0, 'last_update': None,
+                       'last_error': None}
+
+
+    def update(self):
+
+        # The sync time is taken before the API calls and, to allow for clock differences between
+        # this machine and the server, a few minutes of overlap is included (as with --cache-dir)
+        # New comments don't count as activity, so all questions are requested again once the 
+        # last full update is older than --full-sync-days
+        sync_time = int(time.time())
+        full_sync = (not self.last_full_sync 
+                     or sync_time - self.last_full_sync >= self.full_sync_age)
+        if full_sync:
+            question_pages = get_question_pages(self.client, self.filter_string, self.scope,
+                                                self.time_slices)
+        else:
+            question_pages = self.client.get_question_pages(self.filter_string,
+                                                            since=self.last_sync - 300,
+                                                            **self.scope)
+
+        changed_questions = 0
+        question_ids = set()
+        for questions in question_pages:
+            with self.lock:
+                self.apply_questions(questions)
+            changed_questions += len(questions)
+            question_ids.update(normalize_id(question['question_id']) for question in questions)
+        if full_sync: # any other question has been deleted from the site
+            with self.lock:
+                deleted_questions = self.remove_other_questions(question_ids)
+            if deleted_questions:
+                print(f"{deleted_questions} deleted questions removed from the interaction matrix")
+        self.last_sync = sync_time
+        if full_sync:
+            self.last_full_sync = sync_time
+
+        with self.lock:
+            self.status.update({
+                'questions_with_interactions': len(self.question_pair_counts),
+                'updates': self.status['updates'] + 1,
+                'last_update': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(sync_time)),
+                'changed_questions': changed_questions,
+                'team_pairs': len(self.pair_counts)
+            })
+            self.responses = self.get_responses()
+        print(f"{changed_questions} new or updated questions applied to the interaction matrix")
+
+
+    def apply_questions(self, questions):
+
+        for question in questions:
+            question_id = normalize_id(question['question_id'])
+            interaction_data, untracked_interactions = create_interaction_data([question],
+                                                                               self.index)
+            new_pair_counts = count_team_pairs(interaction_data)
+
+            old_pair_counts = self.question_pair_counts.pop(question_id, None)
+            if old_pair_counts:
+                self.pair_counts.subtract(old_pair_counts)
+            # Questions without any team interactions aren't kept, to save memory
+            if new_pair_counts:
+                self.question_pair_counts[question_id] = new_pair_counts
+                self.pair_counts.update(new_pair_counts)
+
+        self.remove_empty_pairs()
+
+
+    def remove_other_questions(self, question_ids):
+
+        deleted_question_ids = [question_id for question_id in self.question_pair_counts
+                                if question_id not in question_ids]
+        for question_id in deleted_question_ids:
+            self.pair_counts.subtract(self.question_pair_counts.pop(question_id))
+        self.remove_empty_pairs()
+
+        return len(deleted_question_ids)
+
+
+    def remove_empty_pairs(self):
+
+        # Remove team pairs that no longer have any interactions
+        for pair in [pair for pair, count in self.pair_counts.items() if count <= 0]:
+            del self.pair_counts[pair]
+
+
+    def poll(self, interval, stop_event):
+
+        while not stop_event.wait(interval):
+            try:
+                self.update()
+            except (Exception, SystemExit) as error: # keep serving, and try again next time
+                print(f"Update failed: {error.__class__.__name__}: {error}")
+                with self.lock:
+                    self.status['last_error'] = f"{time.ctime()}: {error.__class__.__name__}"
+
+
+    def get_responses(self):
+
+        # Rows and columns are sorted, as in interaction_matrix.csv
+        source_teams = sorted({source for source, target in self.pair_counts})
+        target_teams = sorted({target for source, target in self.pair_counts})
+        matrix = [[self.pair_counts.get((source, target), 0) for target in target_teams]
+                  for source in source_teams]
+
+        matrix_csv = io.StringIO()
+        writer = csv.writer(matrix_csv, lineterminator='\n')
+        writer.writerow(['source'] + target_teams)
+        for source, row in zip(source_teams, matrix):
+            writer.writerow([source] + row)
+
+        matrix_json = {
+            'updated': self.status['last_update'],
+            'sources': source_teams,
+            'targets': target_teams,
+            'matrix': matrix
+        }
+
+        # The chord diagram needs the same teams as both rows and columns
+        teams = sorted(set(source_teams) | set(target_teams))
+        square_matrix = [[self.pair_counts.get((source, target), 0) for target in teams]
+                         for source in teams]
+
+        return {
+            '/matrix.csv': ('text/csv; charset=utf-8', matrix_csv.getvalue()),
+            '/matrix.json': ('application/json', json.dumps(matrix_json)),
+            '/': ('text/html; charset=utf-8', get_chord_html(teams, square_matrix)),
+        }
+
+
+    def get_response(self, path):
+
+        with self.lock:
+            if path == '/status':
+                return 'application/json', json.dumps(self.status)
+            return self.responses.get(path)
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        path = self.path.split('?')[0]
+        if path == '/chord_diagram.html':
+            path = '/'
+        response = self.server.service.get_response(path)
+        if not response:
+            self.send_error(404, 'Available: /, /matrix.csv, /matrix.json, /status')
+            return
+
+        content_type, body = response
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+
+    main()
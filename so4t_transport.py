@@ -0,0 +1,319 @@
+# Standard Python libraries
+import gzip
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict, deque
+
+# Third-party libraries
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Local libraries
+from so4t_metrics import metrics
+
+
+# Status codes worth retrying: rate limiting and temporary server/gateway errors
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class Transport(object):
+
+    def __init__(self, pool_size=10, max_retries=5, timeout=(10, 120), backoff_base=1, 
+                 backoff_max=60):
+
+        # A single session reuses connections (keep-alive) instead of opening a new TCP+TLS
+        # connection for every request. The pool should be at least as large as the number of
+        # workers requesting pages in parallel.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        # (connect, read) timeouts in seconds, so a stalled connection is retried (and eventually 
+        # fails) rather than hanging the run
+        self.timeout = tuple(timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # Backoff requests from the API apply to every worker, so they share a single deadline
+        self.backoff_until = 0
+        self.backoff_lock = threading.Lock()
+
+
+    def request(self, method, url, headers=None, params=None, json_data=None, verify=True):
+
+        for attempt in range(self.max_retries + 1):
+            self.wait_for_backoff()
+            metrics.increment('api_requests')
+            try:
+                response = self.session.request(method, url, headers=headers, params=params,
+                                                json=json_data, verify=verify, 
+                                                timeout=self.timeout)
+            except requests.exceptions.SSLError: # handled by the clients' connection tests
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+                if attempt == self.max_retries:
+                    raise
+                backoff_time = self.get_retry_wait(attempt)
+                print(f"Request to {url} failed ({error.__class__.__name__}). "
+                      f"Retrying in {backoff_time:.1f} seconds...")
+                metrics.increment('api_retries')
+                metrics.increment('backoff_seconds', backoff_time)
+                time.sleep(backoff_time)
+                continue
+            metrics.increment('api_bytes_received', len(response.content))
+
+            if response.status_code in [200, 201, 204]:
+                # If the endpoint gets overloaded, API v2 sends a backoff request in the response
+                # Failure to backoff will result in a 502 error (throttle_violation)
+                # Rate limiting documentation: https://api.stackexchange.com/docs/throttle
+                backoff_time = get_backoff(response)
+                if backoff_time:
+                    print(f"API backoff request received. Waiting {backoff_time} seconds...")
+                    self.set_backoff(backoff_time)
+                return response
+
+            if not is_retryable(response) or attempt == self.max_retries:
+                return response
+
+            backoff_time = max(get_retry_after(response), self.get_retry_wait(attempt))
+            print(f"Request to {url} returned status code {response.status_code}. "
+                  f"Retrying in {backoff_time:.1f} seconds...")
+            metrics.increment('api_retries')
+            self.set_backoff(backoff_time)
+
+        return response
+
+
+    def get_retry_wait(self, attempt):
+
+        # Exponential backoff with "full jitter", so parallel workers don't retry in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+    def set_backoff(self, backoff_time):
+
+        with self.backoff_lock:
+            self.backoff_until = max(self.backoff_until, time.monotonic() + backoff_time)
+
+
+    def wait_for_backoff(self):
+
+        with self.backoff_lock:
+            wait_time = self.backoff_until - time.monotonic()
+        if wait_time > 0:
+            metrics.increment('backoff_seconds', wait_time)
+            time.sleep(wait_time)
+
+
+# Saves every API response to a file (newline-delimited JSON, gzip-compressed if the file name ends 
+# in .gz), so that the run can be replayed later with ReplayTransport
+class RecordingTransport(Transport):
+
+    def __init__(self, record_file, pool_size=10, max_retries=5, timeout=(10, 120)):
+
+        super().__init__(pool_size, max_retries, timeout)
+        self.record_file = open_recording(record_file, 'wt')
+        self.record_lock = threading.Lock()
+        print(f"Recording API responses to {record_file}")
+
+
+    def request(self, method, url, headers=None, params=None, json_data=None, verify=True):
+
+        response = super().request(method, url, headers=headers, params=params, 
+                                   json_data=json_data, verify=verify)
+
+        # Request headers are not recorded, so API keys and tokens are not saved to the file
+        recording = {
+            'key': get_request_key(method, url, params, json_data),
+            'url': response.url,
+            'status_code': response.status_code,
+            'headers': dict(response.headers),
+            'body': response.text
+        }
+        with self.record_lock:
+            self.record_file.write(json.dumps(recording) + '\n')
+            self.record_file.flush()
+
+        return response
+
+
+# Serves responses from a file created by RecordingTransport instead of calling the API
+# Requests must match the recorded ones, so use the same arguments as the recorded run
+class ReplayTransport(Transport):
+
+    def __init__(self, replay_file):
+
+        super().__init__()
+        self.recordings = defaultdict(deque)
+        with open_recording(replay_file, 'rt') as f:
+            for line in f:
+                recording = json.loads(line)
+                self.recordings[recording['key']].append(recording)
+        self.replay_lock = threading.Lock()
+        print(f"Replaying API responses from {replay_file}")
+
+
+    def request(self, method, url, headers=None, params=None, json_data=None, verify=True):
+
+        key = get_request_key(method, url, params, json_data)
+        with self.replay_lock:
+            recordings = self.recordings.get(key)
+            if not recordings:
+                print(f"No recorded response found for {method.upper()} {url} {params or ''}")
+                print("Replays must use the same arguments as the recorded run.")
+                raise SystemExit
+            # If the same request was recorded more than once, replay the responses in order
+            if len(recordings) > 1:
+                recording = recordings.popleft()
+            else:
+                recording = recordings[0]
+
+        metrics.increment('api_requests')
+        metrics.increment('api_bytes_received', len(recording['body']))
+
+        return get_recorded_response(method, recording)
+
+
+# Appends every successful GET request (i.e. each page) to a journal file as it completes. With
+# `resume`, requests already in the journal from an earlier, interrupted run are answered from it,
+# so the run carries on from the first page that wasn't received.
+class CheckpointTransport(Transport):
+
+    def __init__(self, journal_file, resume=False, pool_size=10, max_retries=5, 
+                 timeout=(10, 120)):
+
+        super().__init__(pool_size, max_retries, timeout)
+        self.journal = {}
+        if resume and os.path.exists(journal_file):
+            with open(journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        recording = json.loads(line)
+                    except ValueError: # the last line may be incomplete if the run was stopped
+                        break
+                    self.journal[recording['key']] = recording
+            print(f"Resuming from {len(self.journal)} requests saved in {journal_file}")
+            self.journal_file = open(journal_file, 'a', encoding='utf-8')
+        else:
+            self.journal_file = open(journal_file, 'w', encoding='utf-8')
+            print(f"Saving checkpoints to {journal_file}")
+        self.journal_lock = threading.Lock()
+
+
+    def request(self, method, url, headers=None, params=None, json_data=None, verify=True):
+
+        key = get_request_key(method, url, params, json_data)
+        with self.journal_lock:
+            recording = self.journal.get(key)
+        if recording:
+            metrics.increment('checkpoint_requests')
+            return get_recorded_response(method, recording)
+
+        response = super().request(method, url, headers=headers, params=params, 
+                                   json_data=json_data, verify=verify)
+        if method.lower() != 'get' or response.status_code != 200:
+            return response
+
+        recording = {
+            'key': key,
+            'url': response.url,
+            'status_code': response.status_code,
+            'headers': dict(response.headers),
+            'body': response.text
+        }
+        # Write the whole line at once and make sure it is on disk before carrying on
+        with self.journal_lock:
+            self.journal[key] = recording
+            self.journal_file.write(json.dumps(recording) + '\n')
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+
+        return response
+
+
+def get_recorded_response(method, recording):
+
+    response = requests.models.Response()
+    response.status_code = recording['status_code']
+    response.headers = CaseInsensitiveDict(recording['headers'])
+    response.headers.pop('Content-Encoding', None) # the recorded body is already decoded
+    response._content = recording['body'].encode('utf-8')
+    response.encoding = 'utf-8'
+    response.url = recording['url']
+    response.request = requests.Request(method.upper(), recording['url']).prepare()
+
+    return response
+
+
+def open_recording(file_name, mode):
+
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, mode, encoding='utf-8')
+    else:
+        return open(file_name, mode, encoding='utf-8')
+
+
+def get_request_key(method, url, params=None, json_data=None):
+
+    # Identifies a request by its method, URL, and parameters (in a consistent order and type)
+    params = {name: str(value) for name, value in (params or {}).items()}
+
+    return json.dumps([method.lower(), url, params, json_data], sort_keys=True)
+
+
+def get_json(response):
+
+    try:
+        return response.json()
+    except ValueError: # some responses (e.g. errors from a proxy) are not JSON
+        return {}
+
+
+def get_backoff(response):
+
+    # Every successful response passes through here, and the clients parse the JSON themselves, 
+    # so it is only parsed here if it could contain a backoff request (which is rare)
+    if b'"backoff"' not in response.content:
+        return 0
+
+    json_data = get_json(response)
+    if type(json_data) == dict and json_data.get('backoff'):
+        return json_data['backoff'] + 1
+
+    return 0
+
+
+def is_retryable(response):
+
+    if response.status_code in RETRY_STATUS_CODES:
+        return True
+
+    # API v2 reports throttling as an HTTP 400 with an error_name of throttle_violation
+    json_data = get_json(response)
+    return type(json_data) == dict and json_data.get('error_name') == 'throttle_violation'
+
+
+def get_retry_after(response):
+
+    # Retry-After is sent with HTTP 429 responses, in seconds
+    retry_after = response.headers.get('Retry-After', '')
+    if retry_after.isdigit():
+        return int(retry_after) + 1
+
+    # API v2 puts the wait in the throttle_violation error message. Example:
+    # "too many requests from this IP, more requests available in 12 seconds"
+    json_data = get_json(response)
+    if type(json_data) == dict:
+        match = re.search(r'(\d+) seconds', json_data.get('error_message', ''))
+        if match:
+            return int(match.group(1)) + 1
+
+    return 0
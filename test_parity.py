@@ -0,0 +1,90 @@
+'''
+Checks that the faster ways of turning questions into team interactions (--processes and
+--engine columnar) give the same results as the original, serial extraction.
+
+Run with: python3 -m pytest test_parity.py
+'''
+
+# Standard library imports
+import os
+import random
+
+# Third-party libraries
+import pytest
+
+# Local libraries
+from so4t_benchmark import generate_questions, generate_users
+from so4t_export import EXPORT_FORMATS, export_data, load_data
+from so4t_interactions import (LookupIndex, count_team_pairs, create_interaction_data,
+                               create_interaction_data_in_parallel)
+
+
+@pytest.fixture(scope='module')
+def synthetic_data():
+
+    random.seed(0)
+    users = generate_users(500, 20)
+    questions = generate_questions(5000, users)
+
+    # Cover the cases the synthetic data doesn't: users without a team, and comments from the
+    # question's owner on its answers (which are not counted)
+    for user in users[::10]:
+        user['department'] = None
+    for question in questions[::5]:
+        for answer in question['answers']:
+            answer['comments'].append({'owner': dict(question['owner'])})
+
+    return users, questions
+
+
+@pytest.fixture(scope='module')
+def serial_results(synthetic_data):
+
+    users, questions = synthetic_data
+    interaction_data, untracked_interactions = create_interaction_data(questions,
+                                                                       LookupIndex(users))
+
+    return interaction_data, untracked_interactions, count_team_pairs(interaction_data)
+
+
+def test_parallel_extraction_matches_serial(synthetic_data, serial_results):
+
+    users, questions = synthetic_data
+
+    interaction_data, untracked_interactions, pair_counts = serial_results
+
+    assert create_interaction_data_in_parallel(questions, users, 2) == (
+        len(interaction_data), untracked_interactions, pair_counts)
+
+
+@pytest.mark.parametrize('export_format', EXPORT_FORMATS)
+def test_parallel_export_matches_serial(synthetic_data, serial_results, export_format, tmp_path,
+                                        monkeypatch):
+
+    users, questions = synthetic_data
+    interaction_data = serial_results[0]
+    file_name = f"interaction_data.{export_format}"
+    monkeypatch.chdir(tmp_path)
+
+    export_data('interaction_data', (interaction.to_dict() for interaction in interaction_data),
+                export_format)
+    os.rename(file_name, 'serial_' + file_name)
+    create_interaction_data_in_parallel(questions, users, 2, export_format)
+
+    assert load_data('interaction_data', export_format) == [
+        interaction.to_dict() for interaction in interaction_data]
+    if export_format == 'json':
+        with open(file_name, 'rb') as parallel, open('serial_' + file_name, 'rb') as serial:
+            assert parallel.read() == serial.read()
+    assert sorted(os.listdir()) == sorted([file_name, 'serial_' + file_name])
+
+
+def test_columnar_engine_matches_serial(synthetic_data, serial_results):
+
+    from so4t_columnar import count_team_pairs_columnar
+
+    users, questions = synthetic_data
+    interaction_data, untracked_interactions, pair_counts = serial_results
+
+    assert count_team_pairs_columnar(questions, LookupIndex(users).user_teams) == (
+        pair_counts, untracked_interactions)